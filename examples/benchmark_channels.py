@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# MIT License: Nick Sweeting
+
+"""Microbenchmark comparing queue.Queue against mesh.buffers.Channel and RingBuffer.
+
+    python3 examples/benchmark_channels.py [num_packets]
+
+Measures packets/sec for single-threaded put/get, a producer thread feeding a consumer thread,
+and the same with put_many/get_many batches, then a VirtualLink-only chain of forwarding nodes.
+"""
+
+import sys
+import time
+import threading
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+from mesh.buffers import Channel, RingBuffer
+from mesh.links import VirtualLink
+from mesh.node import Node
+from mesh.programs import BaseProgram
+
+
+PACKET = b'x' * 64
+
+
+def bench_put_get(q, num):
+    start = time.time()
+    for _ in range(num):
+        q.put(PACKET)
+    for _ in range(num):
+        q.get(timeout=0)
+    return num / (time.time() - start)
+
+
+def bench_threaded(q, num):
+    def producer():
+        for _ in range(num):
+            q.put(PACKET)
+
+    start = time.time()
+    thread = threading.Thread(target=producer)
+    thread.start()
+    got = 0
+    while got < num:
+        try:
+            q.get(timeout=1)
+            got += 1
+        except Empty:
+            pass
+    thread.join()
+    return num / (time.time() - start)
+
+
+def bench_batched(q, num, batch=64):
+    def producer():
+        for _ in range(num // batch):
+            q.put_many([PACKET] * batch)
+
+    start = time.time()
+    thread = threading.Thread(target=producer)
+    thread.start()
+    got = 0
+    while got < (num // batch) * batch:
+        got += len(q.get_many(batch, timeout=1))
+    thread.join()
+    return num / (time.time() - start)
+
+
+class Forward(BaseProgram):
+    def recv(self, packet, interface):
+        self.node.send(packet, interfaces=[i for i in self.node.interfaces if i is not interface])
+
+
+class ForwardBatch(Forward):
+    def recv_batch(self, packets, interface):
+        self.node.send_batch(packets, interfaces=[i for i in self.node.interfaces if i is not interface])
+
+
+class Count(BaseProgram):
+    received = 0
+
+    def recv(self, packet, interface):
+        self.received += 1
+
+
+def bench_chain(num, hops=4, Program=Forward):
+    links = [VirtualLink('vl%s' % i) for i in range(hops + 1)]
+    nodes = [Node([links[0]], 'start')]
+    nodes += [Node([links[i], links[i + 1]], 's%s' % i, Program=Program, inq_size=num) for i in range(hops)]
+    nodes += [Node([links[-1]], 'end', Program=Count, inq_size=num)]
+    [n.start() for n in nodes]
+
+    start = time.time()
+    for i in range(num):
+        nodes[0].send(b'%d' % i)  # packets have to be unique or the LoopbackFilter eats them
+    while nodes[-1].program.received < num and time.time() - start < 60:
+        time.sleep(0.001)
+    elapsed = time.time() - start
+    [n.stop() for n in nodes]
+    return nodes[-1].program.received / elapsed
+
+
+if __name__ == "__main__":
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    print('%-28s %14s %14s %14s' % ('', 'Queue', 'Channel', 'RingBuffer'))
+    print('%-28s %14d %14d %14d' % ('put/get (pkts/s)', bench_put_get(Queue(), num), bench_put_get(Channel(), num), bench_put_get(RingBuffer(num), num)))
+    print('%-28s %14d %14d %14d' % ('threaded put/get (pkts/s)', bench_threaded(Queue(), num), bench_threaded(Channel(), num), bench_threaded(RingBuffer(num), num)))
+    print('%-28s %14s %14d %14d' % ('batched x64 (pkts/s)', '-', bench_batched(Channel(), num), bench_batched(RingBuffer(num), num)))
+    print('\n%s-hop VirtualLink chain: %d pkts/s end to end' % (4, bench_chain(num // 20)))
+    print('%s-hop VirtualLink chain using recv_batch/send_batch: %d pkts/s end to end' % (4, bench_chain(num // 20, Program=ForwardBatch)))
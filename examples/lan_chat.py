@@ -5,6 +5,7 @@ from mesh.links import UDPLink
 from mesh.programs import BaseProgram
 from mesh.filters import UniqueFilter
 from mesh.node import Node
+from mesh.reactor import Reactor
 
 
 
@@ -14,8 +15,10 @@ class ChatProgram(BaseProgram):
 
 
 if __name__ == "__main__":
-    links = [UDPLink('en0', 2010), UDPLink('en1', 2011), UDPLink('en2', 2012), UDPLink('en3', 2013)]
+    reactor = Reactor()  # one thread reads all four sockets
+    links = [UDPLink('en%s' % i, 2010 + i, reactor=reactor) for i in range(4)]
     node = Node(links, 'me', Filters=(UniqueFilter,), Program=ChatProgram)
+    reactor.start()
     [link.start() for link in links]
     node.start()
 
@@ -30,3 +33,4 @@ if __name__ == "__main__":
     except (EOFError, KeyboardInterrupt):   # graceful CTRL-D & CTRL-C
         node.stop()
         [link.stop() for link in links]
+        reactor.stop()
@@ -3,14 +3,17 @@
 
 from time import sleep
 
-from mesh.links import VirtualLink, UDPLink
+from mesh.links import VirtualLink, UDPLink, UDPMux, MuxLink
 from mesh.programs import Switch, Printer
 from mesh.filters import DuplicateFilter, StringFilter
 from mesh.node import Node
+from mesh.reactor import Reactor
 
 
 # ls = (UDPLink('en0', 2014), VirtualLink('vl1'), VirtualLink('vl2'), IRCLink('irc3'), UDPLink('en4', 2016), IRCLink('irc5'))          # slow, but impressive to connect over IRC
-ls = (UDPLink('en0', 2010), VirtualLink('vl1'), VirtualLink('vl2'), UDPLink('irc3', 2013), UDPLink('en4', 2014), UDPLink('irc5', 2013))    # faster setup for quick testing
+reactor = Reactor()  # one thread reads the sockets of all the UDPLinks
+mux = UDPMux(2013, reactor=reactor)  # irc3 and irc5 share one socket, on the same channel so they hear each other
+ls = (UDPLink('en0', 2010, reactor=reactor), VirtualLink('vl1'), VirtualLink('vl2'), MuxLink('irc3', mux, channel=3), UDPLink('en4', 2014, reactor=reactor), MuxLink('irc5', mux, channel=3))    # faster setup for quick testing
 nodes = (
     Node([ls[0]], 'start'),
     Node([ls[0], ls[2]], 'l1', Program=Switch),
@@ -19,6 +22,8 @@ nodes = (
     Node([ls[1], ls[4]], 'r2', Filters=(StringFilter.match(b'red'),), Program=Switch),   # r2 wont forward any packet unless it contains the string 'red'
     Node([ls[4], ls[5]], 'end', Program=Printer),
 )
+reactor.start()
+mux.start()
 [l.start() for l in ls]
 [n.start() for n in nodes]
 
@@ -45,3 +50,5 @@ if __name__ == "__main__":
     except (EOFError, KeyboardInterrupt):   # CTRL-D, CTRL-C
         print(("All" if all([n.stop() for n in nodes]) else 'Not all') + " nodes stopped cleanly.")
         print(("All" if all([l.stop() for l in ls]) else 'Not all') + " links stopped cleanly.")
+        mux.stop()
+        reactor.stop()
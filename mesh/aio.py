@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# MIT License: Nick Sweeting
+
+# asyncio versions of Node and Program, so big topologies can run in a single thread on one event loop (python3 only).
+# They keep the exact same filters, recv/send and node.inq semantics as the threaded versions, the only difference is
+# that the runloops are tasks on the loop, and the wakeups that links .set() are asyncio Events instead of threading ones.
+
+import asyncio
+import inspect
+import threading
+
+from .buffers import BLOCK
+from .node import Node
+from .programs import BaseProgram
+
+
+class LoopWakeup(object):
+    """An asyncio.Event that links can .set() from any thread, so it can be subscribed to links just like a threading.Event."""
+    def __init__(self, loop):
+        self.loop = loop
+        self.event = asyncio.Event()
+        self.thread_id = threading.get_ident()  # the thread the event loop runs in
+
+    def is_set(self):
+        return self.event.is_set()
+
+    def set(self):
+        if threading.get_ident() == self.thread_id:
+            self.event.set()
+        else:
+            # e.g. a UDPLink runloop putting packets in the queue from its own thread
+            self.loop.call_soon_threadsafe(self.event.set)
+
+    def clear(self):
+        self.event.clear()
+
+    async def wait(self, timeout=None):
+        """wait for the event to be set, returns False if it timed out"""
+        if timeout is None:
+            return await self.event.wait()
+        try:
+            return await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+
+class AsyncNode(Node):
+    """A Node that runs as a task on an asyncio event loop instead of in its own thread.
+        Call node.start(loop) from the thread running the loop, the node's Program should be an AsyncProgram.
+    """
+    idle_timeout = None  # no periodic wakeups, call node.wakeup.set() after changing node.interfaces on a running node
+
+    def __init__(self, *args, **kwargs):
+        if kwargs.get('inq_policy') == BLOCK:
+            raise ValueError('AsyncNode inqs cant use the block policy, blocking the sender would block the whole event loop')
+        Node.__init__(self, *args, **kwargs)
+        self.loop = None
+        self.task = None
+
+    def start(self, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.wakeup = LoopWakeup(self.loop)
+        self.inq_wakeup = LoopWakeup(self.loop)
+        self._subscribe(self.interfaces)  # attach now, so packets sent before the task first runs aren't dropped
+        self.task = self.loop.create_task(self.run())
+        return self.task
+
+    def stop(self):
+        self.keep_listening = False
+        self.wakeup.set()
+        if self.program:
+            self.program.stop()
+        return True
+
+    def is_alive(self):
+        return self.task is not None and not self.task.done()
+
+    ### Runloop
+
+    async def run(self):
+        """runloop task that gets created by node.start()
+        waits until a link wakes us up, then reads all the new packets off the links and feeds them to recv()
+        """
+        if self.program:
+            self.program.start(self.loop)
+        while self.keep_listening:
+            self.wakeup.clear()
+            if self.drain_all():
+                await asyncio.sleep(0)  # give the other nodes a turn before draining the rest
+            else:
+                await self.wakeup.wait(self.idle_timeout)
+        self._subscribe(())
+        self.log("Stopped listening.")
+
+
+class AsyncProgram(BaseProgram):
+    """A Program that runs as a task on its node's event loop.
+        recv() and recv_batch() can either be plain functions or coroutines (async def).
+    """
+    def __init__(self, node):
+        BaseProgram.__init__(self, node)
+        self.loop = None
+        self.task = None
+
+    def start(self, loop=None):
+        self.loop = loop or self.node.loop or asyncio.get_event_loop()
+        self.task = self.loop.create_task(self.run())
+        return self.task
+
+    def stop(self):
+        self.keep_listening = False
+        self.node.inq_wakeup.set()
+
+    def is_alive(self):
+        return self.task is not None and not self.task.done()
+
+    async def run(self):
+        """runloop task that waits until the node puts packets in its inq, then handles them"""
+        wakeup = self.node.inq_wakeup
+        while self.keep_listening:
+            wakeup.clear()
+            if await self.process():
+                await asyncio.sleep(0)  # give the other programs a turn before handling the rest
+            else:
+                await wakeup.wait()
+
+    async def process(self):
+        """handle one weighted round-robin round of packets across all the node's interfaces
+        returns True if an interface used up its whole quota, i.e. there may be more packets waiting
+        """
+        pending = False
+        for interface in list(self.node.interfaces):
+            quota = self.max_batch * (self.weights.get(interface, 1) if self.weights else 1)
+            packets = self.node.inq[interface].get_many(quota)
+            if packets:
+                result = self.recv_batch(packets, interface)
+                if inspect.isawaitable(result):
+                    await result
+            if len(packets) == quota:
+                pending = True
+        return pending
+
+    async def recv_batch(self, packets, interface):
+        for packet in packets:
+            result = self.recv(packet, interface)
+            if inspect.isawaitable(result):
+                await result
+
+
+async def run_until_stopped(nodes):
+    """wait for the runloop tasks of all the given (started) nodes and their programs to finish"""
+    tasks = [node.task for node in nodes if node.task]
+    tasks += [node.program.task for node in nodes if node.program and node.program.task]
+    await asyncio.gather(*tasks)
@@ -0,0 +1,322 @@
+import random
+import threading
+from collections import deque
+from time import time
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+# what a RingBuffer does with a new packet when it's full
+DROP_TAIL = 'drop-tail'    # drop the new packet
+DROP_HEAD = 'drop-head'    # make room by dropping the oldest packet in the buffer
+BLOCK = 'block'            # make the sender wait for room (backpressure), drop the new packet if it times out
+RED = 'red'                # random early drop, drops more and more new packets as the buffer fills up past red_threshold
+
+POLICIES = (DROP_TAIL, DROP_HEAD, BLOCK, RED)
+
+
+class Channel(object):
+    """An unbounded FIFO built on collections.deque, for many producers and a single consumer.
+        deque.append() and deque.popleft() are atomic, so puts and gets never take a lock, unlike queue.Queue.
+        The consumer only pays for an Event when it actually has to block and wait for an item.
+        It has the same get/put interface as queue.Queue, plus put_many/get_many to move items in batches.
+    """
+    def __init__(self):
+        self.items = deque()
+        self._waiter = None  # Event the consumer is blocked on, only set while someone is waiting
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, len(self.items))
+
+    def __len__(self):
+        return len(self.items)
+
+    def qsize(self):
+        return len(self.items)
+
+    def empty(self):
+        return not self.items
+
+    def full(self):
+        return False
+
+    def _wake(self):
+        waiter = self._waiter
+        if waiter is not None:
+            waiter.set()
+
+    def put(self, item, block=True, timeout=None):
+        """add an item to the channel, returns False if the item was dropped"""
+        self.items.append(item)
+        self._wake()
+        return True
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def put_many(self, items, block=True, timeout=None):
+        """add several items with a single wakeup, returns how many were added"""
+        items = list(items)
+        self.items.extend(items)
+        if items:
+            self._wake()
+        return len(items)
+
+    def get(self, block=True, timeout=None):
+        """remove and return the oldest item, raises queue.Empty if there's nothing to get"""
+        try:
+            return self.items.popleft()
+        except IndexError:
+            if not block or (timeout is not None and timeout <= 0) or not self.wait(timeout):
+                raise Empty
+        try:
+            return self.items.popleft()
+        except IndexError:
+            raise Empty
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def get_many(self, max_items=None, timeout=0):
+        """remove and return a list of up to max_items (default all) of the oldest items
+        if the channel is empty, wait up to timeout seconds (None waits forever) for something to arrive
+        """
+        items = self.items
+        if not items and timeout != 0 and not self.wait(timeout):
+            return []
+        count = len(items) if max_items is None else min(max_items, len(items))
+        popleft = items.popleft
+        batch = []
+        try:
+            for _ in range(count):
+                batch.append(popleft())
+        except IndexError:
+            pass  # another consumer got to them first
+        return batch
+
+    def wait(self, timeout=None):
+        """block until there's something in the channel, returns False if it timed out"""
+        if self.items:
+            return True
+        waiter = threading.Event()
+        self._waiter = waiter
+        try:
+            # check again now that producers can see the waiter, in case an item arrived in between
+            return bool(self.items) or waiter.wait(timeout) or bool(self.items)
+        finally:
+            self._waiter = None
+
+
+class RingBuffer(Channel):
+    """A bounded Channel with a drop policy for when it overflows.
+        Every packet that gets dropped is counted in .stats, so loss under overload is visible.
+    """
+    def __init__(self, maxsize=1024, policy=DROP_TAIL, red_threshold=0.5):
+        if policy not in POLICIES:
+            raise ValueError('Unknown overflow policy %r, must be one of %s' % (policy, ', '.join(POLICIES)))
+        Channel.__init__(self)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.red_threshold = int(maxsize * red_threshold)  # RED starts dropping once the buffer is this full
+        if policy == DROP_HEAD:
+            self.items = deque(maxlen=maxsize)  # deque evicts the oldest item by itself when appending to a full buffer
+        self._space_waiter = None  # Event a blocked sender is waiting on for room to free up
+        self.stats = {
+            'enqueued': 0,
+            'dequeued': 0,
+            'dropped_tail': 0,     # new packets dropped because the buffer was full (drop-tail, or block timed out)
+            'dropped_head': 0,     # old packets evicted to make room for new ones (drop-head)
+            'dropped_early': 0,    # new packets dropped early by random early drop (red)
+            'blocked': 0,          # times a sender had to wait for room (block)
+            'high_water': 0,       # most packets that were ever in the buffer at once
+        }
+
+    def __repr__(self):
+        return '<RingBuffer %s/%s %s>' % (len(self.items), self.maxsize, self.policy)
+
+    def full(self):
+        return len(self.items) >= self.maxsize
+
+    def _admit(self, block, timeout):
+        """apply the overflow policy before adding one item, returns False if the new item should be dropped"""
+        size = len(self.items)
+        if self.policy == RED and size >= self.red_threshold:
+            # drop probability rises linearly from 0 at red_threshold to 1 when full
+            if size >= self.maxsize or random.random() < float(size - self.red_threshold + 1) / (self.maxsize - self.red_threshold + 1):
+                self.stats['dropped_early'] += 1
+                return False
+        elif size >= self.maxsize:
+            if self.policy == DROP_HEAD:
+                self.stats['dropped_head'] += 1
+            elif self.policy == BLOCK and block:
+                self.stats['blocked'] += 1
+                if not self._wait_for_space(timeout):
+                    self.stats['dropped_tail'] += 1
+                    return False
+            else:
+                self.stats['dropped_tail'] += 1
+                return False
+        return True
+
+    def _wait_for_space(self, timeout=None):
+        deadline = None if timeout is None else time() + timeout
+        while len(self.items) >= self.maxsize:
+            remaining = None if deadline is None else deadline - time()
+            if remaining is not None and remaining <= 0:
+                return False
+            waiter = threading.Event()
+            self._space_waiter = waiter
+            if len(self.items) >= self.maxsize:
+                waiter.wait(remaining)
+            self._space_waiter = None
+        return True
+
+    def _taken(self, count):
+        self.stats['dequeued'] += count
+        waiter = self._space_waiter
+        if waiter is not None:
+            waiter.set()
+
+    def put(self, item, block=True, timeout=None):
+        """add an item to the buffer, returns False if the item was dropped"""
+        if not self._admit(block, timeout):
+            return False
+        self.items.append(item)
+        self.stats['enqueued'] += 1
+        if len(self.items) > self.stats['high_water']:
+            self.stats['high_water'] = len(self.items)
+        self._wake()
+        return True
+
+    def put_many(self, items, block=True, timeout=None):
+        """add several items with a single wakeup, returns how many were added (the rest were dropped)
+        with the block policy, timeout is for the whole batch: whatever doesn't fit by then is dropped
+        """
+        items = list(items)
+        deadline = None if timeout is None else time() + timeout
+        added = 0
+        for i, item in enumerate(items):
+            if self.policy == BLOCK and block and len(self.items) >= self.maxsize:
+                self._wake()  # the reader has to know about what we've added so far, or it'll never make room
+                if not self._admit(block, None if deadline is None else max(0.0, deadline - time())):
+                    self.stats['dropped_tail'] += len(items) - i - 1  # out of time, the rest would block too
+                    break
+            elif not self._admit(block, timeout):
+                continue
+            self.items.append(item)
+            added += 1
+        self.stats['enqueued'] += added
+        if len(self.items) > self.stats['high_water']:
+            self.stats['high_water'] = len(self.items)
+        if added:
+            self._wake()
+        return added
+
+    def get(self, block=True, timeout=None):
+        item = Channel.get(self, block, timeout)
+        self._taken(1)
+        return item
+
+    def get_many(self, max_items=None, timeout=0):
+        batch = Channel.get_many(self, max_items, timeout)
+        if batch:
+            self._taken(len(batch))
+        return batch
+
+
+class FanoutLog(object):
+    """An append-only log that many readers consume through their own cursors.
+        Each item is stored once no matter how many readers there are, and reading is just moving a cursor forward.
+        Items get trimmed off the front once every cursor has passed them, and a reader that falls more than
+        max_backlog items behind skips ahead so memory stays bounded (counted in .stats['skipped']).
+    """
+    def __init__(self, max_backlog=65536, trim_every=1024):
+        self.max_backlog = max_backlog
+        self.trim_every = trim_every    # how many appends between trims, trimming has to look at every cursor
+        self.entries = []
+        self.base = 0                   # log position of entries[0]
+        self.cursors = {}               # reader: log position of the next item it will read
+        self.lock = threading.Lock()
+        self.readable = threading.Condition(self.lock)
+        self.waiting = 0                # readers blocked in read(), so appends only notify when someone is listening
+        self.since_trim = 0
+        self.stats = {'appended': 0, 'trimmed': 0, 'skipped': 0}
+
+    def __repr__(self):
+        return '<FanoutLog %s entries %s readers>' % (len(self.entries), len(self.cursors))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add_reader(self, reader):
+        """readers start at the end of the log, they only see what gets appended after they join"""
+        with self.lock:
+            self.cursors.setdefault(reader, self.base + len(self.entries))
+
+    def remove_reader(self, reader):
+        with self.lock:
+            self.cursors.pop(reader, None)
+
+    def append(self, item):
+        self.append_many((item,))
+
+    def append_many(self, items):
+        with self.lock:
+            before = len(self.entries)
+            self.entries.extend(items)
+            added = len(self.entries) - before
+            self.stats['appended'] += added
+            self.since_trim += added
+            if self.since_trim >= self.trim_every or len(self.entries) > self.max_backlog:
+                self._trim()
+            if self.waiting:
+                self.readable.notify_all()
+
+    def read(self, reader, max_items=None, timeout=0, accept=None):
+        """return up to max_items items past reader's cursor (only ones where accept(item) is true, if given),
+        and move the cursor past everything that was looked at.  Waits up to timeout seconds if there's nothing to read
+        """
+        with self.lock:
+            if reader not in self.cursors:
+                return []
+            if timeout != 0 and self.cursors[reader] >= self.base + len(self.entries):
+                self.waiting += 1
+                try:
+                    self.readable.wait(timeout)
+                finally:
+                    self.waiting -= 1
+                if reader not in self.cursors:
+                    return []
+            entries = self.entries
+            pos = self.cursors[reader] - self.base
+            end = len(entries)
+            if accept is None:
+                stop = end if max_items is None else min(end, pos + max_items)
+                items = entries[pos:stop]
+                pos = stop
+            else:
+                items = []
+                while pos < end and (max_items is None or len(items) < max_items):
+                    if accept(entries[pos]):
+                        items.append(entries[pos])
+                    pos += 1
+            self.cursors[reader] = self.base + pos
+            return items
+
+    def _trim(self):
+        """drop the entries every reader has read, skipping readers that are too far behind ahead first (lock must be held)"""
+        self.since_trim = 0
+        end = self.base + len(self.entries)
+        oldest_allowed = end - self.max_backlog
+        for reader, cursor in self.cursors.items():
+            if cursor < oldest_allowed:
+                self.stats['skipped'] += oldest_allowed - cursor
+                self.cursors[reader] = oldest_allowed
+        first_unread = min(self.cursors.values()) if self.cursors else end
+        count = first_unread - self.base
+        if count > 0:
+            del self.entries[:count]
+            self.base = first_unread
+            self.stats['trimmed'] += count
@@ -1,7 +1,11 @@
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+import os
+import math
 import time
 import random
+import struct
 import hashlib
+import threading
 
 class BaseFilter:
     """Filters work just like iptables filters, they are applied in order to all incoming and outgoing packets
@@ -22,6 +26,16 @@ class BaseFilter:
         """
         return packet
 
+    # the batch versions run a whole list of packets through tr/tx, and return the list of packets that weren't dropped
+    # override them if your filter can handle a batch faster than one packet at a time
+    def tr_many(self, packets, interface):
+        tr = self.tr
+        return [packet for packet in (tr(p, interface) for p in packets) if packet]
+
+    def tx_many(self, packets, interface):
+        tx = self.tx
+        return [packet for packet in (tx(p, interface) for p in packets) if packet]
+
 class DuplicateFilter(BaseFilter):
     """filter sending/receiving duplicates of the same packet in a row.
 
@@ -49,54 +63,180 @@ class DuplicateFilter(BaseFilter):
 class LoopbackFilter(BaseFilter):
     """Filter recv copies of packets that the node just sent out.
         Needed whenever your node is connected to a BROADCAST link where all packets go to everyone.
+        Sends that never come back (unicast links, lost datagrams) are forgotten after max_age seconds,
+        or once there are more than max_count newer ones, so the memory stays bounded.
     """
+    max_count = 4096    # sent packets to wait for copies of
+    max_age = 10.0      # seconds to wait for a copy to come back
+
     def __init__(self):
-        self.sent_hashes = defaultdict(int)  # defaults to 0
+        self.sent_hashes = OrderedDict()  # hash: [copies to ignore, time last sent], oldest first
         # serves as a counter. each packet is hashed,
         # if we see that hash sent once we can ignore one received copy,
         # if we send it twice on two ifaces, we can ignore two received copies
+        self.lock = threading.Lock()  # tr runs on the node's thread, tx on the program's
+        self.clock = time.time        # where max_age is measured from, simulations swap in their virtual clock
+
+    def _expire(self, now):
+        """forget the oldest sends (lock must be held)"""
+        sent_hashes = self.sent_hashes
+        while len(sent_hashes) > self.max_count:
+            sent_hashes.popitem(last=False)
+        expired = now - self.max_age
+        while sent_hashes and next(iter(sent_hashes.values()))[1] < expired:
+            sent_hashes.popitem(last=False)
 
     def tr(self, packet, interface):
         if not packet: return None
-        elif self.sent_hashes[hash(packet)] > 0:
-            self.sent_hashes[hash(packet)] -= 1
-            return None
-        else:
-            return packet
+        sent_hashes = self.sent_hashes
+        if not sent_hashes:
+            return packet  # nothing sent recently, no need to take the lock
+        packet_hash = hash(packet)
+        with self.lock:
+            self._expire(self.clock())
+            entry = sent_hashes.get(packet_hash)
+            if entry is None:
+                return packet
+            entry[0] -= 1
+            if not entry[0]:
+                del sent_hashes[packet_hash]  # got all the copies we were expecting
+        return None
 
     def tx(self, packet, interface):
         if not packet: return None
-        else:
-            self.sent_hashes[hash(packet)] += 1
-            return packet
+        now = self.clock()
+        packet_hash = hash(packet)
+        sent_hashes = self.sent_hashes
+        with self.lock:
+            entry = sent_hashes.get(packet_hash)
+            if entry is None:
+                sent_hashes[packet_hash] = [1, now]
+            else:
+                entry[0] += 1
+                entry[1] = now
+                sent_hashes.move_to_end(packet_hash)
+            self._expire(now)
+        return packet
 
 class UniqueFilter(BaseFilter):
+    """Filter packets that the node has already seen (received or sent), e.g. copies of a flood coming back around.
+        It only remembers the last max_count packets, for up to max_age seconds, so the memory stays flat however long it runs.
+        Node('mynode', Filters=[UniqueFilter.window(max_count=10000, max_age=60), ...])
+        Node('mynode', Filters=[UniqueFilter.probabilistic(error_rate=0.0001), ...])   # Bloom filters, a fraction of the memory
+    """
+    max_count = 65536   # packets to remember
+    max_age = 600.0     # seconds to remember a packet for, None to keep it until max_count newer ones push it out
+
     def __init__(self):
-        self.seen = set()
+        self.key = os.urandom(16)  # keyed digests, so nobody can craft packets that collide with someone else's
+        self.seen = OrderedDict()  # digest: time last seen, least recently seen first
+        self.lock = threading.Lock()  # tr runs on the node's thread, tx on the program's
+        self.clock = time.time        # where max_age is measured from, simulations swap in their virtual clock
 
-    @staticmethod
-    def hash(string):
-        return hashlib.md5(string).hexdigest()
+    def hash(self, packet):
+        return hashlib.blake2b(packet, digest_size=8, key=self.key).digest()
+
+    def seen_before(self, packet):
+        """remember the packet, returns True if it was already remembered"""
+        packet_hash = self.hash(packet)
+        seen = self.seen
+        with self.lock:
+            now = self.clock()
+            # forget the oldest ones first, so a packet that's been forgotten isn't still found
+            if self.max_age is not None:
+                expired = now - self.max_age
+                while seen and next(iter(seen.values())) < expired:
+                    seen.popitem(last=False)
+            found = packet_hash in seen
+            if found:
+                seen.move_to_end(packet_hash)  # still going around, keep remembering it
+            seen[packet_hash] = now
+            while len(seen) > self.max_count:
+                seen.popitem(last=False)
+        return found
 
     def tr(self, packet, interface):
         if not packet:
             return None
-
-        packet_hash = self.hash(packet)
-        if packet_hash in self.seen:
-            return None
-        else:
-            self.seen.add(packet_hash)
-            return packet
+        return None if self.seen_before(packet) else packet
 
     def tx(self, packet, interface):
         if not packet:
             return None
-
-        packet_hash = self.hash(packet)
-        self.seen.add(packet_hash)
+        self.seen_before(packet)
         return packet
 
+    @classmethod
+    def window(cls, max_count=65536, max_age=600.0):
+        """Factory method to create a UniqueFilter that remembers max_count packets for up to max_age seconds."""
+        window_count, window_age = max_count, max_age
+
+        class WindowedUniqueFilter(cls):
+            max_count = window_count
+            max_age = window_age
+        return WindowedUniqueFilter
+
+    @classmethod
+    def probabilistic(cls, error_rate=0.001, max_count=65536, max_age=600.0):
+        """Factory method to create a BloomUniqueFilter, which drops a new packet as a duplicate with about error_rate odds."""
+        return BloomUniqueFilter.window(max_count, max_age, error_rate)
+
+class BloomUniqueFilter(UniqueFilter):
+    """UniqueFilter that remembers packets in two rotating Bloom filters instead of a dict of digests.
+        It takes ~1.44 * log2(1 / error_rate) bits per packet (2.6KB per 1000 packets at 0.1%) instead of ~100 bytes,
+        but a small fraction of new packets get dropped as if they were duplicates.
+        New packets go in the current generation, which replaces the previous one once it holds max_count packets or is
+        max_age seconds old, so packets are remembered for at least max_count packets / max_age seconds, and at most twice that.
+    """
+    error_rate = 0.001  # odds of a new packet being mistaken for one we've seen
+
+    def __init__(self):
+        self.key = os.urandom(16)
+        # sized so that checking both generations together stays under error_rate
+        error_rate = self.error_rate / 2
+        self.num_bits = int(math.ceil(-self.max_count * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(self.num_bits / float(self.max_count) * math.log(2))))
+        self.current = bytearray((self.num_bits + 7) // 8)
+        self.previous = bytearray(len(self.current))
+        self.count = 0                  # packets added to the current generation
+        self.started = None             # when the current generation was started, on the first packet so it's on self.clock
+        self.lock = threading.Lock()
+        self.clock = time.time
+
+    def _bits(self, packet):
+        """the num_hashes bit positions for a packet, from one digest (double hashing)"""
+        h1, h2 = struct.unpack('!QQ', hashlib.blake2b(packet, digest_size=16, key=self.key).digest())
+        num_bits = self.num_bits
+        return [(h1 + i * h2) % num_bits for i in range(self.num_hashes)]
+
+    def seen_before(self, packet):
+        bits = self._bits(packet)
+        with self.lock:
+            now = self.clock()
+            if self.started is None:
+                self.started = now
+            if self.count >= self.max_count or (self.max_age is not None and now - self.started > self.max_age):
+                self.previous, self.current = self.current, bytearray(len(self.current))
+                self.count = 0
+                self.started = now
+            current, previous = self.current, self.previous
+            in_current = all(current[b >> 3] & (1 << (b & 7)) for b in bits)
+            if not in_current:
+                for b in bits:
+                    current[b >> 3] |= 1 << (b & 7)
+                self.count += 1
+            return in_current or all(previous[b >> 3] & (1 << (b & 7)) for b in bits)
+
+    @classmethod
+    def window(cls, max_count=65536, max_age=600.0, error_rate=0.001):
+        window_count, window_age, window_error_rate = max_count, max_age, error_rate
+
+        class WindowedBloomUniqueFilter(cls):
+            max_count = window_count
+            max_age = window_age
+            error_rate = window_error_rate
+        return WindowedBloomUniqueFilter
+
 class StringFilter(BaseFilter):
     """Filter for packets that contain a string pattern.
         Node('mynode', Filters=[StringFilter.match('pattern'), ...])
@@ -1,16 +1,23 @@
 import threading
 
 try:
-    from queue import Queue, Empty
+    from queue import Empty
 except ImportError:
-    from Queue import Queue, Empty
+    from Queue import Empty
 
-from time import sleep
+import base64
+import struct
+import hashlib
+import weakref
+import os
+from errno import EAGAIN, EWOULDBLOCK, ENOBUFS, EINPROGRESS
+from collections import deque, OrderedDict
+from time import sleep, time
 from random import randint
-from collections import defaultdict
 
-import select
-from socket import socket, AF_INET, SOCK_DGRAM, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, SO_BROADCAST
+from socket import socket, error as SocketError, timeout as SocketTimeout, inet_aton, AF_INET, SOCK_DGRAM, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, SO_BROADCAST, SO_RCVBUF
+from socket import IPPROTO_IP, IP_ADD_MEMBERSHIP, IP_MULTICAST_TTL, IP_MULTICAST_LOOP, IP_MULTICAST_IF
+from socket import socketpair, IPPROTO_TCP, TCP_NODELAY, SO_ERROR
 
 try:
     # needed for BSD systems like macOS
@@ -20,13 +27,32 @@ except:
     # not needed on non-BSD systems (e.g. linux)
     IS_BSD = False
 
+try:
+    # recvmsg lets UDPLink see truncated datagrams and the kernel's drop counter (not available on windows or python2)
+    from socket import MSG_TRUNC, CMSG_SPACE
+    HAS_RECVMSG = hasattr(socket, 'recvmsg_into')
+except ImportError:
+    HAS_RECVMSG = False
+
+try:
+    from socket import AF_UNIX
+except ImportError:
+    AF_UNIX = None  # windows
+
+HAS_SENDMSG = hasattr(socket, 'sendmsg')  # for StreamLink to write many frames in one syscall
+
+SO_RXQ_OVFL = 40  # linux only: attaches the count of datagrams the kernel dropped (socket buffer full) to each recvmsg
+
+from .buffers import Channel, FanoutLog
+from .reactor import Reactor
+
 
 class VirtualLink:
     """A Link represents a network link between Nodes.
     Nodes.interfaces is a list of the [Link]s that it's connected to.
     Some links are BROADCAST (all connected nodes get a copy of all packets),
     others are UNICAST (you only see packets directed to you), or
-    MULTICAST (you can send packets to several people at once).
+    MULTICAST (you can send packets to several people at once, by sending to a group address they've joined with join_group()).
     Some links are virtual, others actually send the traffic over UDP or IRC.
     Give two nodes the same VirtualLink() object to simulate connecting them with a cable."""
     broadcast_addr = "00:00:00:00:00:00:00"
@@ -35,9 +61,18 @@ class VirtualLink:
         self.name = name
         self.keep_listening = True
 
-        # buffer for receiving incoming packets
-        self.inq = defaultdict(Queue)  # mac_addr: [packet1, packet2, ...]
-        self.inq[self.broadcast_addr] = Queue()
+        # buffer for receiving incoming packets, only attach()ed addresses get one
+        # copy-on-write: attach/detach swap in a new dict, so senders can iterate over it without taking the lock
+        self.inq = {}  # mac_addr: [packet1, packet2, ...]
+        self.taps = ()  # promiscuous mac_addrs, each gets its own copy of all the traffic on the link (also copy-on-write)
+        self.groups = {}  # multicast group_addr: (member mac_addr, ...) (also copy-on-write)
+
+        # wakeups (anything with a .set() method, e.g. threading.Event) to fire when packets are queued for an address
+        self.listeners = {}  # mac_addr: (event1, event2, ...)
+        self.owners = {}  # mac_addr: (token, weakref.finalize) that detaches it when its owner is garbage collected
+        self._registry_lock = threading.RLock()  # reentrant: an owner's finalizer can run during a gc while this thread holds it
+
+        self.stats = {'undeliverable': 0}  # packets sent to addresses that aren't attached to the link
 
     ### Utilities
 
@@ -71,42 +106,444 @@ class VirtualLink:
         self.log("Went down.")
         return True
 
+    ### Membership
+
+    def attach(self, mac_addr, owner=None, promiscuous=False):
+        """start collecting packets for mac_addr on this link, packets for addresses that aren't attached are dropped
+        promiscuous addresses are taps: their queue also gets a copy of the unicast traffic between everyone else
+        (attaching the broadcast address gives you a tap too, so recv() on it still gives you all the packets)
+        if an owner object (e.g. the Node) is given, mac_addr is detached automatically once the owner is garbage collected,
+        unless it was detached or attached by a different owner before that
+        """
+        mac_addr = str(mac_addr)
+        promiscuous = promiscuous or mac_addr == self.broadcast_addr
+        with self._registry_lock:
+            self._add_inbox(mac_addr)
+            if promiscuous and mac_addr not in self.taps:
+                self.taps += (mac_addr,)
+            elif not promiscuous and mac_addr in self.taps:
+                self.taps = tuple(tap for tap in self.taps if tap != mac_addr)
+            if owner is not None:
+                current = self.owners.get(mac_addr)
+                alive = current and current[1].peek()
+                if not alive or alive[0] is not owner:
+                    if current:
+                        current[1].detach()  # the address belongs to the new owner now
+                    token = object()
+                    self.owners[mac_addr] = (token, weakref.finalize(owner, self._owner_collected, mac_addr, token))
+
+    def detach(self, mac_addr):
+        """stop collecting packets for mac_addr, and throw away its queue and wakeups"""
+        mac_addr = str(mac_addr)
+        with self._registry_lock:
+            self._detach(mac_addr)
+
+    def _detach(self, mac_addr):
+        owner = self.owners.pop(mac_addr, None)
+        if owner:
+            owner[1].detach()
+        self._remove_inbox(mac_addr)
+        self.taps = tuple(tap for tap in self.taps if tap != mac_addr)
+        self.listeners.pop(mac_addr, None)
+        for group_addr, members in list(self.groups.items()):
+            if mac_addr in members:
+                self._set_members(group_addr, tuple(m for m in members if m != mac_addr))
+
+    def _owner_collected(self, mac_addr, token):
+        """the owner of mac_addr was garbage collected without detaching, detach it if it's still the one attached"""
+        with self._registry_lock:
+            current = self.owners.get(mac_addr)
+            if current and current[0] is token:
+                self._detach(mac_addr)
+
+    def is_attached(self, mac_addr):
+        return str(mac_addr) in self.inq
+
+    def join_group(self, group_addr, mac_addr):
+        """add mac_addr to a multicast group, packets sent to group_addr go to every member's queue
+        group addresses share the namespace with mac_addrs, so pick ones that no node uses, e.g. "01:00:5e:00:00:01"
+        """
+        group_addr, mac_addr = str(group_addr), str(mac_addr)
+        with self._registry_lock:
+            members = self.groups.get(group_addr, ())
+            if mac_addr not in members:
+                self._set_members(group_addr, members + (mac_addr,))
+
+    def leave_group(self, group_addr, mac_addr):
+        group_addr, mac_addr = str(group_addr), str(mac_addr)
+        with self._registry_lock:
+            members = self.groups.get(group_addr, ())
+            self._set_members(group_addr, tuple(m for m in members if m != mac_addr))
+
+    def members(self, group_addr):
+        return self.groups.get(str(group_addr), ())
+
+    def _set_members(self, group_addr, members):
+        groups = dict(self.groups)
+        if members:
+            groups[group_addr] = members
+        else:
+            groups.pop(group_addr, None)  # empty groups are forgotten, sending to them is like sending to an unknown address
+        self.groups = groups
+
+    def _add_inbox(self, mac_addr):
+        """make sure there's somewhere to collect the packets for mac_addr (registry lock must be held)"""
+        if mac_addr not in self.inq:
+            inq = dict(self.inq)
+            inq[mac_addr] = Channel()
+            self.inq = inq
+
+    def _remove_inbox(self, mac_addr):
+        if mac_addr in self.inq:
+            inq = dict(self.inq)
+            del inq[mac_addr]
+            self.inq = inq
+
+    ### Wakeups
+
+    def subscribe(self, listener, mac_addr=broadcast_addr):
+        """register a listener to be .set() whenever a packet is queued for mac_addr"""
+        mac_addr = str(mac_addr)
+        with self._registry_lock:
+            # copy-on-write, so senders can iterate over the listeners without taking the lock
+            self.listeners[mac_addr] = self.listeners.get(mac_addr, ()) + (listener,)
+
+    def unsubscribe(self, listener, mac_addr=broadcast_addr):
+        mac_addr = str(mac_addr)
+        with self._registry_lock:
+            listeners = tuple(l for l in self.listeners.get(mac_addr, ()) if l is not listener)
+            if listeners:
+                self.listeners[mac_addr] = listeners
+            else:
+                self.listeners.pop(mac_addr, None)
+
+    def _notify(self, mac_addr=broadcast_addr):
+        """wake up everyone waiting on packets for mac_addr (and the taps), broadcasts wake up all the listeners"""
+        listeners = self.listeners
+        if mac_addr == self.broadcast_addr:
+            to_wake = [l for subscribed in list(listeners.values()) for l in subscribed]
+        else:
+            members = self.groups.get(mac_addr, (mac_addr,))
+            to_wake = ()
+            for member in members:
+                to_wake += listeners.get(member, ())
+            for tap in self.taps:
+                if tap not in members:
+                    to_wake += listeners.get(tap, ())
+        for listener in to_wake:
+            if not listener.is_set():
+                listener.set()
+
     ### IO
 
     def recv(self, mac_addr=broadcast_addr, timeout=0):
         """read packet off the recv queue for a given address, optional timeout to block and wait for packet"""
-        # recv on the broadcast address "00:..:00" will give you all packets (for promiscuous mode)
+        # recv on a promiscuous address will give you all packets, see attach()
         if self.keep_listening:
+            inq = self.inq.get(str(mac_addr))
             try:
-                return self.inq[str(mac_addr)].get(timeout=timeout)
+                return inq.get(timeout=timeout) if inq is not None else ""
             except Empty:
                 return ""
         else:
             self.log("is down.")
 
+    def recv_many(self, mac_addr=broadcast_addr, max_packets=None, timeout=0):
+        """read a list of up to max_packets (default all) packets off the recv queue for a given address"""
+        if self.keep_listening:
+            inq = self.inq.get(str(mac_addr))
+            return inq.get_many(max_packets, timeout=timeout) if inq is not None else []
+        else:
+            self.log("is down.")
+            return []
+
     def send(self, packet, mac_addr=broadcast_addr):
         """place sent packets directly into the reciever's queues (as if they are connected by wire)"""
         if self.keep_listening:
-            if mac_addr == self.broadcast_addr:
-                for addr, recv_queue in self.inq.items():
-                    recv_queue.put(packet)
-            else:
-                self.inq[mac_addr].put(packet)
-                self.inq[self.broadcast_addr].put(packet)
+            self._deliver((packet,), mac_addr)
+        else:
+            self.log("is down.")
+
+    def send_many(self, packets, mac_addr=broadcast_addr):
+        """place a list of packets in the reciever's queues, with one put and one wakeup per queue"""
+        if self.keep_listening:
+            self._deliver(packets, mac_addr)
+        else:
+            self.log("is down.")
+
+    def _deliver(self, packets, mac_addr=broadcast_addr):
+        """put packets in the recv queue for mac_addr (plus each tap's), in every member's queue if it's a multicast group,
+        or in every queue if it's a broadcast
+        packets for addresses that aren't attached only go to the taps, like a frame nobody picks up off the wire
+        """
+        inq = self.inq
+        if mac_addr == self.broadcast_addr:
+            for recv_queue in inq.values():
+                recv_queue.put_many(packets)
+        else:
+            members = self.groups.get(mac_addr)
+            if members is None:
+                members = (mac_addr,)
+                if mac_addr not in inq:
+                    self.stats['undeliverable'] += len(packets)
+            for member in members:
+                recv_queue = inq.get(member)  # could have just been detached
+                if recv_queue is not None:
+                    recv_queue.put_many(packets)
+            for tap in self.taps:
+                recv_queue = inq.get(tap)
+                if tap not in members and recv_queue is not None:
+                    recv_queue.put_many(packets)
+        self._notify(mac_addr)
+
+class FanoutLink(VirtualLink):
+    """A VirtualLink that keeps its traffic in one shared FanoutLog instead of a queue per listening node.
+    Sending a packet appends it to the log once, no matter how many nodes are on the link, and each node's recv()
+    just moves its own cursor forward.  Good for big flat LANs, where broadcasting to a queue per node gets expensive.
+    Unicast packets go in the same log, and readers skip the ones that aren't addressed to them (except taps).
+    """
+    def __init__(self, name="vlan1", max_backlog=65536):
+        VirtualLink.__init__(self, name=name)
+        self.inq = None  # unused, everything goes in the log
+        self.log_buffer = FanoutLog(max_backlog=max_backlog)
+
+    def __len__(self):
+        """number of nodes listening for packets on this link"""
+        return len(self.log_buffer.cursors)
+
+    def is_attached(self, mac_addr):
+        return str(mac_addr) in self.log_buffer.cursors
+
+    def _add_inbox(self, mac_addr):
+        self.log_buffer.add_reader(mac_addr)
+
+    def _remove_inbox(self, mac_addr):
+        self.log_buffer.remove_reader(mac_addr)
+
+    def _accept(self, mac_addr):
+        if mac_addr in self.taps:
+            return None  # promiscuous, gets everything
+        broadcast_addr = self.broadcast_addr
+        def accept(entry):
+            to = entry[0]
+            return to == broadcast_addr or to == mac_addr or (type(to) is tuple and mac_addr in to)
+        return accept
+
+    ### IO
+
+    def recv(self, mac_addr=VirtualLink.broadcast_addr, timeout=0):
+        """read the next packet for a given address off the log, optional timeout to block and wait for packet"""
+        if self.keep_listening:
+            packets = self.recv_many(mac_addr, 1, timeout)
+            return packets[0] if packets else ""
         else:
             self.log("is down.")
 
+    def recv_many(self, mac_addr=VirtualLink.broadcast_addr, max_packets=None, timeout=0):
+        """read a list of up to max_packets (default all) packets for a given address off the log"""
+        if not self.keep_listening:
+            self.log("is down.")
+            return []
+        mac_addr = str(mac_addr)
+        entries = self.log_buffer.read(mac_addr, max_packets, timeout, self._accept(mac_addr))
+        return [packet for _, packet in entries]
+
+    def _deliver(self, packets, mac_addr=VirtualLink.broadcast_addr):
+        to = self.groups.get(mac_addr, mac_addr)  # multicasts are logged with the members at the time they were sent
+        if to == mac_addr and mac_addr != self.broadcast_addr and mac_addr not in self.log_buffer.cursors:
+            self.stats['undeliverable'] += len(packets)
+            if not self.taps:
+                return  # nobody would ever read it
+        self.log_buffer.append_many([(to, packet) for packet in packets])
+        self._notify(mac_addr)
+
+class FragmentingLink(object):
+    """Mix in before any link class to let it carry packets bigger than it can send in one piece.
+    Packets over fragment_mtu bytes are split into fragments with a small header, and the receiving link puts them
+    back together before the nodes see them.  Incomplete packets are thrown away after fragment_timeout seconds,
+    or oldest-first once they hold more than max_fragment_bytes bytes, so lost fragments can't use up the memory.
+
+      class BulkUDPLink(FragmentingLink, UDPLink): pass
+      link = BulkUDPLink('en0', 2016, fragment_mtu=1400)
+
+    Both ends of the link need to be fragmenting, packets that fit are sent as-is.  For a UDPMux, mix it into the MuxLinks.
+    Fragments are binary, so a link that only carries lines of text needs its framing on, e.g. IRCLink(..., framing='base85'),
+    without it the binary fragment headers and pieces don't survive being sent as text.
+    The mixin's own attributes all start with fragment or _reassembly, so they don't clobber the state of the link they're mixed into.
+    """
+    fragment_mtu = 1400             # max size of a fragment including its header, keep it under what the link can carry
+    fragment_timeout = 5.0          # seconds to wait for the rest of a packet's fragments
+    max_fragment_bytes = 4194304    # max bytes of incomplete packets to hold on to
+
+    # FRAGMENT_MAGIC, packet id, fragment index, fragment count, then that piece of the packet
+    # small packets that happen to start with the magic are sent as 1 fragment, so they don't get mistaken for one
+    FRAGMENT_MAGIC = b'\xfa\xf7'
+    FRAGMENT = struct.Struct('!2sIHH')
+
+    def __init__(self, *args, **kwargs):
+        self.fragment_mtu = kwargs.pop('fragment_mtu', self.fragment_mtu)
+        self.fragment_timeout = kwargs.pop('fragment_timeout', self.fragment_timeout)
+        self.max_fragment_bytes = kwargs.pop('max_fragment_bytes', self.max_fragment_bytes)
+        super(FragmentingLink, self).__init__(*args, **kwargs)
+        if self.fragment_mtu <= self.FRAGMENT.size:
+            raise ValueError("fragment_mtu has to leave room for the %s byte fragment header" % self.FRAGMENT.size)
+        self._fragment_id = randint(0, 0xffffffff)  # random start, so links on different hosts don't reuse each other's ids
+        self._reassembly = OrderedDict()  # (mac_addr, packet id, count): [expires, pieces, pieces received, bytes], oldest first
+        self._reassembly_bytes = 0
+        self._fragment_lock = threading.Lock()
+        self.stats.update({'fragmented': 0, 'fragments_sent': 0, 'reassembled': 0,
+                           'reassembly_expired': 0, 'reassembly_evicted': 0, 'bad_fragments': 0})
+
+    ### IO
+
+    def send(self, packet, *args):
+        self.send_many((packet,), *args)
+
+    def send_many(self, packets, *args):
+        """split up the packets that are too big, then send the pieces like any other packets"""
+        super(FragmentingLink, self).send_many(self._fragment_packets(packets), *args)
+
+    def _fragment_packets(self, packets):
+        header, magic = self.FRAGMENT, self.FRAGMENT_MAGIC
+        room = self.fragment_mtu - header.size
+        out = []
+        for packet in packets:
+            if len(packet) <= self.fragment_mtu and not packet.startswith(magic):
+                out.append(packet)
+                continue
+            count = -(-len(packet) // room) or 1  # ceil
+            if count > 0xffff:
+                self.log("packet of %s bytes is too big to fragment, dropped" % len(packet))
+                continue
+            packet_id = self._fragment_id = (self._fragment_id + 1) & 0xffffffff
+            for index in range(count):
+                out.append(header.pack(magic, packet_id, index, count) + packet[index * room:(index + 1) * room])
+            self.stats['fragmented'] += 1
+            self.stats['fragments_sent'] += count
+        return out
+
+    def _deliver(self, packets, mac_addr=VirtualLink.broadcast_addr):
+        """put the fragments back together, and pass the whole packets on to the link's own _deliver in order"""
+        header, magic = self.FRAGMENT, self.FRAGMENT_MAGIC
+        whole = []
+        with self._fragment_lock:
+            self._expire_fragments()
+            for packet in packets:
+                if not packet.startswith(magic):
+                    whole.append(packet)
+                    continue
+                if len(packet) < header.size:
+                    self.stats['bad_fragments'] += 1
+                    continue
+                _, packet_id, index, count = header.unpack_from(packet)
+                if index >= count:
+                    self.stats['bad_fragments'] += 1
+                    continue
+                if count == 1:
+                    whole.append(packet[header.size:])
+                    continue
+                packet = self._reassemble((mac_addr, packet_id, count), index, packet[header.size:])
+                if packet is not None:
+                    whole.append(packet)
+        if whole:
+            super(FragmentingLink, self)._deliver(whole, mac_addr)
+
+    def _reassemble(self, key, index, piece):
+        """add a piece to its partial packet (the fragment lock must be held), returns the packet once it's complete"""
+        entry = self._reassembly.get(key)
+        if entry is None:
+            entry = self._reassembly[key] = [time() + self.fragment_timeout, [None] * key[2], 0, 0]
+        pieces = entry[1]
+        if pieces[index] is not None:
+            return None  # duplicate
+        pieces[index] = piece
+        entry[2] += 1
+        entry[3] += len(piece)
+        self._reassembly_bytes += len(piece)
+        if entry[2] == len(pieces):
+            del self._reassembly[key]
+            self._reassembly_bytes -= entry[3]
+            self.stats['reassembled'] += 1
+            return b''.join(pieces)
+        while self._reassembly_bytes > self.max_fragment_bytes and self._reassembly:
+            self._drop_oldest_fragment('reassembly_evicted')
+        return None
+
+    def _expire_fragments(self):
+        """throw away the partial packets that have been waiting too long (they're in the order they were started)"""
+        now = time()
+        while self._reassembly and next(iter(self._reassembly.values()))[0] < now:
+            self._drop_oldest_fragment('reassembly_expired')
+
+    def _drop_oldest_fragment(self, counter):
+        _, entry = self._reassembly.popitem(last=False)
+        self._reassembly_bytes -= entry[3]
+        self.stats[counter] += 1
+
 class UDPLink(threading.Thread, VirtualLink):
     """This link sends all traffic as BROADCAST UDP packets on all physical ifaces.
     Connect nodes on two different laptops to a UDPLink() with the same port and they will talk over wifi or ethernet.
+    Packets sent within coalesce seconds of each other get packed into the same datagram (up to the mtu), so chatty
+    programs make far fewer syscalls, and the receiving UDPLink unpacks them again.
+
+    Instead of broadcasting to every host on the LAN, the traffic can go only to the hosts that are in the mesh:
+      UDPLink('en0', 2016, multicast_group='239.255.20.16')   IP multicast, only hosts that joined the group get it
+      UDPLink('en0', 2016, peers=['10.0.0.5', ...])           unicast to each peer, starting from a few seed addresses
+                                                              and learning the rest from who sends us packets
     """
 
-    def __init__(self, name="en0", port=2016):
-        # UDPLinks have to be run in a seperate thread
-        # they rely on the infinite run() loop to read packets out of the socket, which would block the main thread
+    max_recv_batch = 256    # max datagrams to read off the socket before handing them to the nodes
+    max_retries = 8         # times to retry a datagram the kernel couldn't take (e.g. full send buffer) before dropping it
+    max_retry_delay = 0.2   # the retry backoff doubles from 1ms up to this
+
+    # packed datagrams start with FRAME_MAGIC, then each packet as a 2 byte length + the packet
+    # a datagram holding a single packet is sent as-is, so unpacked peers can still read it
+    FRAME_MAGIC = b'\xfa\xce'
+    FRAME_LEN = struct.Struct('!H')
+
+    def __init__(self, name="en0", port=2016, recv_size=65535, rcvbuf=None, reactor=None, coalesce=0.001, mtu=1472,
+                 multicast_group=None, ttl=1, multicast_loop=True, interface='0.0.0.0', peers=None, peer_timeout=60.0):
+        # UDPLinks need a thread to read packets out of the socket, which would block the main thread
+        # with a shared Reactor (see reactor.py) its thread does the reading and the link is passive,
+        # otherwise the link makes a private reactor and runs it in its own thread
         threading.Thread.__init__(self)
         VirtualLink.__init__(self, name=name)
         self.port = port
+        self.own_reactor = reactor is None
+        self.reactor = reactor or Reactor(name)
+        self.recv_size = recv_size  # datagrams bigger than this get truncated (and counted), 65535 fits any UDP packet
+        self.rcvbuf = rcvbuf        # kernel socket buffer size (SO_RCVBUF), raise it if stats['kernel_dropped'] keeps going up
+        self.coalesce = coalesce    # seconds to wait for more packets to send in the same datagram, 0 to send right away
+        self.mtu = mtu              # max size of a packed datagram, 1472 fits in a 1500 byte ethernet frame with the IP & UDP headers
+        self.interface = interface  # IP of the local interface to use for multicast, the default lets the OS pick
+
+        self.multicast_group = multicast_group
+        self.ttl = ttl                          # how many routers multicast packets can cross, 1 = stay on the LAN
+        self.multicast_loop = multicast_loop    # get our own multicast packets back, so links on the same host can talk
+        if multicast_group:
+            self.send_addr = (multicast_group, port)
+        else:
+            self.send_addr = ('255.255.255.255', port)  # 255. is the broadcast IP for UDP
+
+        # unicast mode: the seeds are always sent to, other peers are learned when they send us something,
+        # and forgotten if we haven't heard from them in peer_timeout seconds
+        self.unicast = peers is not None
+        self.seeds = set(peer if isinstance(peer, tuple) else (peer, port) for peer in (peers or ()))
+        self.peers = {}  # (ip, port): time last heard from
+        self.peer_timeout = peer_timeout
+        self._keepalive_timer = None
+
+        self.outq = []              # packets waiting for the coalescing window to end
+        self.sendq = deque()        # (packed datagram, address) waiting to go out (only touched by the reactor thread)
+        self._send_lock = threading.Lock()
+        self._flush_scheduled = False
+        self._retry_timer = None
+        self._retry_delay = 0
+        self._retries = 0
+        self.stats.update({
+            'received': 0, 'truncated': 0, 'kernel_dropped': 0,
+            'sent': 0, 'datagrams_sent': 0, 'send_retries': 0, 'send_dropped': 0, 'peers_learned': 0, 'peers_expired': 0,
+        })
         # self.log("starting...")
         self._initsocket()
 
@@ -114,59 +551,719 @@ class UDPLink(threading.Thread, VirtualLink):
         return "<" + self.name + ">"
 
     def _initsocket(self):
-        """bind to the datagram socket (UDP), and enable BROADCAST mode"""
+        """bind to the datagram socket (UDP), and enable BROADCAST (or MULTICAST) mode"""
         self.send_socket = socket(AF_INET, SOCK_DGRAM)
         self.send_socket.setblocking(0)
         self.send_socket.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+        if self.multicast_group:
+            self.send_socket.setsockopt(IPPROTO_IP, IP_MULTICAST_TTL, self.ttl)
+            self.send_socket.setsockopt(IPPROTO_IP, IP_MULTICAST_LOOP, 1 if self.multicast_loop else 0)
+            if self.interface != '0.0.0.0':
+                self.send_socket.setsockopt(IPPROTO_IP, IP_MULTICAST_IF, inet_aton(self.interface))
 
         self.recv_socket = socket(AF_INET, SOCK_DGRAM)
         self.recv_socket.setblocking(0)
         if IS_BSD:
             self.recv_socket.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)  # requires sudo
         self.recv_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)  # allows multiple UDPLinks to all listen for UDP packets
+        if self.rcvbuf:
+            self.recv_socket.setsockopt(SOL_SOCKET, SO_RCVBUF, self.rcvbuf)
         self.recv_socket.bind(('', self.port))
+        if self.multicast_group:
+            membership = inet_aton(self.multicast_group) + inet_aton(self.interface)
+            self.recv_socket.setsockopt(IPPROTO_IP, IP_ADD_MEMBERSHIP, membership)
+        if self.unicast:
+            # send from the bound socket, so the source address peers learn is one we're actually listening on
+            self.send_socket.close()
+            self.send_socket = self.recv_socket
+
+        # one buffer that every datagram gets read into, instead of allocating a new one per recv
+        self.recv_buffer = bytearray(self.recv_size)
+        self.recv_view = memoryview(self.recv_buffer)
+        self.ancillary_size = 0
+        if HAS_RECVMSG:
+            try:
+                self.recv_socket.setsockopt(SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self.ancillary_size = CMSG_SPACE(4)
+            except (SocketError, OSError):
+                pass  # not linux, kernel drops just won't be counted
 
     ### Runloop
 
+    def start(self):
+        self.reactor.register(self.recv_socket, self._read_ready)
+        if self.unicast:
+            self.reactor.call_soon(self._keepalive)  # say hello, so the seeds learn about us
+        if self.own_reactor:
+            return threading.Thread.start(self)
+        return True
+
+    def stop(self):
+        self.keep_listening = False
+        self.reactor.call_soon(self._flush)  # send whatever is still waiting for its window
+        if self._keepalive_timer:
+            self.reactor.cancel(self._keepalive_timer)
+        self.reactor.unregister(self.recv_socket)
+        if self.own_reactor:
+            self.reactor.stop()
+            if self.is_alive():
+                self.join()
+        self.log("Went down.")
+        return True
+
     def run(self):
-        """runloop that reads incoming packets off the interface into the inq buffer"""
+        """the link's own thread runs its private reactor, which reads incoming packets off the interface into the inq buffer"""
         # self.log("ready to receive.")
-        # we use a runloop instead of synchronous recv so stopping the node mid-recv is possible
-        read_ready = None
+        self.reactor.run()
 
-        while self.keep_listening:
+    def _read_ready(self):
+        """read every datagram waiting in the socket, so bursts don't pile up in the kernel between wakeups"""
+        batch = []
+        while True:
+            received = self._recv_one()
+            if received is None:
+                break
+            packet, addr = received
+            if self.unicast:
+                self._learn(addr)
+            if packet[:2] == self.FRAME_MAGIC:
+                batch.extend(self._unpack(packet))
+            else:
+                batch.append(packet)
+            if len(batch) >= self.max_recv_batch:
+                self._deliver(batch)  # put packets in the recv queue of every node listening to this link
+                batch = []
+        if batch:
+            self._deliver(batch)
+
+    def _recv_one(self):
+        """read one datagram into the reusable buffer and return a copy of it and who sent it, or None once the socket would block"""
+        try:
+            if HAS_RECVMSG:
+                nbytes, ancdata, flags, addr = self.recv_socket.recvmsg_into([self.recv_buffer], self.ancillary_size)
+                truncated = flags & MSG_TRUNC
+                for level, kind, data in ancdata:
+                    if level == SOL_SOCKET and kind == SO_RXQ_OVFL and len(data) >= 4:
+                        self.stats['kernel_dropped'] = struct.unpack('=I', data[:4])[0]  # running total for the socket
+            else:
+                nbytes, addr = self.recv_socket.recvfrom_into(self.recv_buffer)
+                truncated = nbytes >= self.recv_size  # can't tell for sure without recvmsg, assume a full buffer was cut off
+        except (SocketError, OSError):
+            return None  # EAGAIN, nothing left to read
+        self.stats['received'] += 1
+        if truncated:
+            self.stats['truncated'] += 1
+        return self.recv_view[:nbytes].tobytes(), addr
+
+    ### Peers
+
+    def _learn(self, addr):
+        if addr not in self.peers and addr not in self.seeds:
+            self.stats['peers_learned'] += 1
+        self.peers[addr] = time()
+
+    def _keepalive(self):
+        """forget peers we haven't heard from in a while, and remind the rest that we're here (unicast mode)"""
+        if not self.keep_listening:
+            return
+        now = time()
+        for addr, last_heard in list(self.peers.items()):
+            if now - last_heard > self.peer_timeout:
+                del self.peers[addr]
+                self.stats['peers_expired'] += 1
+        # an empty frame unpacks to no packets, so it keeps us in their peer tables without bothering the nodes
+        hello = self.FRAME_MAGIC
+        self.sendq.extend((hello, addr) for addr in self._destinations())
+        if self._retry_timer is None:
+            self._send_datagrams()
+        self._keepalive_timer = self.reactor.call_later(self.peer_timeout / 3.0, self._keepalive)
+
+    def _destinations(self):
+        if self.unicast:
+            return self.seeds.union(self.peers)
+        return (self.send_addr,)
+
+    ### Framing
+
+    def _pack(self, packets):
+        """pack a list of packets into as few datagrams of up to mtu bytes as possible"""
+        datagrams, frame, size = [], [], len(self.FRAME_MAGIC)
+        for packet in packets:
+            if frame and size + 2 + len(packet) > self.mtu:
+                datagrams.append(self._frame(frame))
+                frame, size = [], len(self.FRAME_MAGIC)
+            frame.append(packet)
+            size += 2 + len(packet)
+        if frame:
+            datagrams.append(self._frame(frame))
+        return datagrams
+
+    def _frame(self, packets):
+        packet = packets[0]
+        if len(packets) == 1 and (packet[:2] != self.FRAME_MAGIC or len(packet) > 65535):
+            return packet  # on its own, or too big for the length field anyway
+        pack_len = self.FRAME_LEN.pack
+        return self.FRAME_MAGIC + b''.join(pack_len(len(p)) + p for p in packets)
+
+    def _unpack(self, datagram):
+        """split a packed datagram back into its packets, if it doesn't parse it's treated as one packet"""
+        packets, offset, end = [], len(self.FRAME_MAGIC), len(datagram)
+        unpack_len = self.FRAME_LEN.unpack_from
+        while offset < end:
+            if offset + 2 > end:
+                return [datagram]
+            length, = unpack_len(datagram, offset)
+            offset += 2
+            if offset + length > end:
+                return [datagram]
+            packets.append(datagram[offset:offset + length])
+            offset += length
+        return packets
+
+    ### IO
+
+    def send(self, packet):
+        """queue a packet to be sent down the line to the inteface, it goes out when the coalescing window ends"""
+        self.send_many((packet,))
+
+    def send_many(self, packets):
+        if not self.keep_listening:
+            self.log("is down.")
+            return
+        if self.unicast:
+            # broadcast and multicast datagrams come back to our own socket, unicast ones don't,
+            # so hand them to the other nodes on this link directly
+            packets = list(packets)
+            self._deliver(packets)
+        with self._send_lock:
+            self.outq.extend(packets)
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        if self.coalesce:
+            self.reactor.call_later(self.coalesce, self._flush)
+        else:
+            self.reactor.call_soon(self._flush)
+
+    def _flush(self):
+        """end of the coalescing window: pack up the queued packets and send them (runs on the reactor thread)"""
+        with self._send_lock:
+            packets, self.outq = self.outq, []
+            self._flush_scheduled = False
+        if packets:
+            self.stats['sent'] += len(packets)
+            destinations = self._destinations()
+            self.sendq.extend((datagram, addr) for datagram in self._pack(packets) for addr in destinations)
+        if self._retry_timer is None:  # otherwise the retry will send them, in order
+            self._send_datagrams()
+
+    def _send_datagrams(self):
+        """send the packed datagrams, if the kernel can't take one right now retry later instead of blocking"""
+        self._retry_timer = None
+        while self.sendq:
+            datagram, addr = self.sendq[0]
             try:
-                read_ready, w, x = select.select([self.recv_socket], [], [], 0.01)
-            except Exception:
-                # catch timeouts
-                pass
-
-            if read_ready:
-                packet, addr = read_ready[0].recvfrom(4096)
-                if addr[1] == self.port:
-                    # for each address listening to this link
-                    for mac_addr, recv_queue in self.inq.items():
-                        recv_queue.put(packet)  # put packet in node's recv queue
+                self.send_socket.sendto(datagram, addr)
+            except (SocketError, OSError) as e:
+                if getattr(e, 'errno', None) in (EAGAIN, EWOULDBLOCK, ENOBUFS) and self._retries < self.max_retries:
+                    # full send buffer, back off and try again from the reactor, the sender never waits
+                    self._retries += 1
+                    self._retry_delay = min(self._retry_delay * 2 or 0.001, self.max_retry_delay)
+                    self.stats['send_retries'] += 1
+                    self._retry_timer = self.reactor.call_later(self._retry_delay, self._send_datagrams)
+                    return
+                self.log("Link failed to send packet over socket %s" % e)
+                self.stats['send_dropped'] += 1
+            else:
+                self.stats['datagrams_sent'] += 1
+            self.sendq.popleft()
+            self._retries = 0
+            self._retry_delay = 0
+
+class UDPMux(UDPLink):
+    """One UDP socket that carries the traffic of many logical MuxLinks, so hundreds of links between two hosts
+    need one socket and one reader instead of hundreds.  Every packet gets a 4 byte channel id in front of it,
+    and incoming packets are handed to the links on that channel by looking it up in a table.
+    Takes all the same options as UDPLink (reactor, coalesce, multicast_group, peers, ...).
+    """
+    CHANNEL = struct.Struct('!I')
+
+    def __init__(self, port=2016, name=None, **kwargs):
+        UDPLink.__init__(self, name=name or "mux%s" % port, port=port, **kwargs)
+        self.channels = {}  # channel id: (MuxLink, ...), copy-on-write like the inq
+        self.stats['unknown_channel'] = 0
+
+    def add(self, link):
+        with self._registry_lock:
+            for other in self.channels.get(link.channel, ()):
+                if other.name != link.name and not (link.explicit_channel and other.explicit_channel):
+                    raise ValueError("%s and %s both hash to channel %s on %s, give one of them a channel=" % (
+                        other, link, link.channel, self))
+            channels = dict(self.channels)
+            channels[link.channel] = channels.get(link.channel, ()) + (link,)
+            self.channels = channels
+
+    def remove(self, link):
+        with self._registry_lock:
+            channels = dict(self.channels)
+            links = tuple(l for l in channels.get(link.channel, ()) if l is not link)
+            if links:
+                channels[link.channel] = links
+            else:
+                channels.pop(link.channel, None)
+            self.channels = channels
+
+    def send_channel(self, packets, channel):
+        tag = self.CHANNEL.pack(channel)
+        UDPLink.send_many(self, [tag + packet for packet in packets])
+
+    def _deliver(self, packets, mac_addr=VirtualLink.broadcast_addr):
+        """split the incoming packets up by channel, and deliver each run of them to the links on that channel"""
+        channels = self.channels
+        tag_size = self.CHANNEL.size
+        run, run_channel = [], None
+        for packet in packets:
+            if len(packet) < tag_size:
+                continue
+            channel, = self.CHANNEL.unpack_from(packet)
+            if channel != run_channel:
+                self._deliver_channel(channels, run_channel, run)
+                run, run_channel = [], channel
+            run.append(packet[tag_size:])
+        self._deliver_channel(channels, run_channel, run)
+
+    def _deliver_channel(self, channels, channel, packets):
+        if not packets:
+            return
+        links = channels.get(channel)
+        if not links:
+            self.stats['unknown_channel'] += len(packets)
+            return
+        for link in links:
+            link._deliver(packets)
+
+
+class MuxLink(VirtualLink):
+    """A logical link that sends and receives through a shared UDPMux, tagged with its channel id.
+    Links on different hosts talk to each other if they use the same channel on the same port,
+    the channel defaults to a hash of the link's name so that naming them the same is enough.
+    """
+    def __init__(self, name="vlan1", mux=None, channel=None):
+        VirtualLink.__init__(self, name=name)
+        self.mux = mux
+        self.explicit_channel = channel is not None
+        self.channel = channel if self.explicit_channel else self.hash_channel(name)
+        mux.add(self)
+
+    @staticmethod
+    def hash_channel(name):
+        # 4 bytes, so even thousands of names across all the hosts on the port are unlikely to ever share a channel
+        return struct.unpack('!I', hashlib.blake2b(name.encode(), digest_size=4).digest())[0]
+
+    def stop(self):
+        self.mux.remove(self)
+        return VirtualLink.stop(self)
+
+    def send(self, packet, mac_addr=VirtualLink.broadcast_addr):
+        self.send_many((packet,), mac_addr)
+
+    def send_many(self, packets, mac_addr=VirtualLink.broadcast_addr):
+        """send packets out over the mux, everyone on the channel (including us) gets them, like UDPLink"""
+        if self.keep_listening:
+            self.mux.send_channel(packets, self.channel)
+        else:
+            self.log("is down.")
+
+class StreamConnection(object):
+    """One persistent connection of a StreamLink, it survives reconnects if we dialed it (addr is set)."""
+    def __init__(self, addr=None, sock=None):
+        self.addr = addr            # address to reconnect to, None for connections someone else opened
+        self.sock = sock
+        self.connected = False
+        self.outq = deque()         # frames waiting for the kernel to take them
+        self.out_bytes = 0
+        self.head_sent = 0          # bytes of outq[0] already written
+        self.inbuf = bytearray()    # bytes read that don't make up a whole frame yet
+        self.delay = 0              # current reconnect backoff
+
+    def __repr__(self):
+        return "<connection %s%s>" % (self.addr or (self.sock and self.sock.fileno()), "" if self.connected else " down")
+
+
+class StreamLink(threading.Thread, VirtualLink):
+    """Base for links that carry packets over reliable byte streams to other hosts or processes (TCPLink, UnixSocketLink).
+    Each peer gets one persistent connection shared by all the nodes on the link.  Packets are length-prefixed frames,
+    so any bytes of any size get through intact, and everything queued for a peer goes out in one sendmsg() call.
+    Connections we dialed are reconnected with backoff when they drop, packets sent meanwhile are kept for them
+    (up to max_backlog bytes) and go out once they're back.
+    Sent packets are also delivered to the other nodes on the same link object, like the other links do.
+    """
+    FRAME = struct.Struct('!IB')    # packet length, destination mac length (0 for broadcast), then the mac and the packet
+    recv_size = 65536               # bytes to read per recv() call, into a reusable buffer
+    max_iov = 1024                  # max frames per sendmsg() call (IOV_MAX on linux)
+    max_frame = 64 * 1024 * 1024    # anything longer means the stream is corrupt, the connection gets dropped
+    close_timeout = 1.0             # seconds stop() gives the peers to take what's still queued for them
+
+    def __init__(self, name="stream1", listen=None, peers=(), reactor=None, max_backlog=32 * 1024 * 1024,
+                 reconnect_delay=0.05, max_reconnect_delay=5.0):
+        # the sockets are read and written by a Reactor (see reactor.py), shared or our own running in our thread
+        threading.Thread.__init__(self)
+        VirtualLink.__init__(self, name=name)
+        self.own_reactor = reactor is None
+        self.reactor = reactor or Reactor(name)
+        self.listen_addr = listen
+        self.peer_addrs = list(peers)
+        self.max_backlog = max_backlog                  # bytes to hold for a peer that's down or not keeping up
+        self.reconnect_delay = reconnect_delay          # the reconnect backoff doubles from this,
+        self.max_reconnect_delay = max_reconnect_delay  # up to this
+        self.listen_socket = None
+        self.connections = []   # StreamConnections, only touched by the reactor thread
+        self.closed = threading.Event()  # set once stop() has sent what it could and hung up on everyone
+        self._close_deadline = None
+
+        self.outq = []          # frames sent since the last flush
+        self._send_lock = threading.Lock()
+        self._flush_scheduled = False
+        self.recv_buffer = bytearray(self.recv_size)
+        self.recv_view = memoryview(self.recv_buffer)
+        self.stats.update({'sent': 0, 'received': 0, 'connects': 0, 'disconnects': 0, 'backlog_dropped': 0})
+
+    def __repr__(self):
+        return "<" + self.name + ">"
+
+    ### Sockets, the subclasses say what kind
+
+    def _socket(self):
+        raise NotImplementedError()
+
+    def _listen(self, addr):
+        raise NotImplementedError()
+
+    def _setup(self, sock):
+        """called on every new connection"""
+        sock.setblocking(0)
+
+    ### Runloop
+
+    def start(self):
+        if self.listen_addr is not None:
+            self.listen_socket = self._listen(self.listen_addr)
+            self.listen_socket.setblocking(0)
+            self.reactor.register(self.listen_socket, self._on_accept)
+        for addr in self.peer_addrs:
+            self.reactor.call_soon(self._connect, StreamConnection(addr))
+        if self.own_reactor:
+            return threading.Thread.start(self)
+        return True
+
+    def stop(self):
+        self.keep_listening = False
+        # the reactor sends what's left without blocking, we're the ones that wait for it
+        if self.reactor.call_soon(self._close_all) and self.reactor.thread_id not in (None, threading.get_ident()):
+            self.closed.wait(self.close_timeout + 1)
+        if self.own_reactor:
+            self.reactor.stop()
+            if self.is_alive():
+                self.join()
+        self.log("Went down.")
+        return True
+
+    def run(self):
+        """the link's own thread runs its private reactor"""
+        self.reactor.run()
+
+    def adopt(self, sock):
+        """use an already connected socket (e.g. one end of a socketpair()) as a connection of this link"""
+        conn = StreamConnection(None, sock)
+        self.reactor.call_soon(self._add, conn)
+        return conn
+
+    ### Connections (everything below runs on the reactor thread)
+
+    def _add(self, conn):
+        self.connections.append(conn)
+        self.reactor.register(conn.sock, lambda: self._on_readable(conn), lambda: self._on_writable(conn))
+        self._connected(conn)
+
+    def _connect(self, conn):
+        if not self.keep_listening:
+            return
+        if conn not in self.connections:
+            self.connections.append(conn)
+        try:
+            conn.sock = self._socket()
+            conn.sock.setblocking(0)
+            err = conn.sock.connect_ex(conn.addr)
+        except (SocketError, OSError) as e:
+            err = e  # e.g. the hostname doesn't resolve (yet), keep retrying with the backoff like any other failure
+        if err not in (0, EINPROGRESS, EAGAIN, EWOULDBLOCK):
+            self._lost(conn)
+            return
+        # it's connected once it's writable, see _on_writable
+        self.reactor.register(conn.sock, lambda: self._on_readable(conn), lambda: self._on_writable(conn))
+        self.reactor.want_write(conn.sock)
+
+    def _connected(self, conn):
+        conn.connected = True
+        conn.delay = 0
+        self._setup(conn.sock)
+        self.stats['connects'] += 1
+        self._write(conn)
+
+    def _lost(self, conn):
+        """the connection dropped (or never came up), dial it again later if it's ours"""
+        if conn.sock is not None:
+            self.reactor.unregister(conn.sock)
+            conn.sock.close()
+            conn.sock = None
+        if conn.connected:
+            self.stats['disconnects'] += 1
+        conn.connected = False
+        conn.inbuf = bytearray()
+        if conn.head_sent:
+            # the peer got half of this frame on the old connection, it can't be finished on the new one
+            conn.out_bytes -= len(conn.outq.popleft())
+            conn.head_sent = 0
+        if conn.addr is not None and self.keep_listening:
+            conn.delay = min(max(conn.delay * 2, self.reconnect_delay), self.max_reconnect_delay)
+            self.reactor.call_later(conn.delay, self._connect, conn)
+        elif conn in self.connections:
+            self.connections.remove(conn)
+
+    def _close_all(self):
+        """send what's left, then hang up on everyone, without ever blocking the reactor (other links may share it)"""
+        self._flush()  # the kernel takes what it can now, _on_writable sends the rest as the peers read it
+        if self.listen_socket is not None:
+            self.reactor.unregister(self.listen_socket)
+            self.listen_socket.close()
+            self.listen_socket = None
+        for conn in self.connections:
+            conn.addr = None  # don't redial anyone
+        self._close_deadline = time() + self.close_timeout
+        self._close_when_sent()
+
+    def _close_when_sent(self):
+        """hang up on the connections that have sent everything, and keep checking on the rest until the deadline"""
+        give_up = time() >= self._close_deadline
+        for conn in list(self.connections):
+            if conn.connected and conn.outq and not give_up:
+                continue
+            conn.outq.clear()
+            conn.out_bytes = 0
+            conn.head_sent = 0
+            self._lost(conn)
+        if self.connections:
+            self.reactor.call_later(0.01, self._close_when_sent)
+        else:
+            self.closed.set()
+
+    def _on_accept(self):
+        while True:
+            try:
+                sock, addr = self.listen_socket.accept()
+            except (SocketError, OSError):
+                return  # EAGAIN, no more waiting
+            self._add(StreamConnection(None, sock))
+
+    def _on_writable(self, conn):
+        if conn.sock is None:
+            return
+        if not conn.connected:
+            err = conn.sock.getsockopt(SOL_SOCKET, SO_ERROR)
+            if err:
+                self._lost(conn)
+                return
+            self._connected(conn)
+        else:
+            self._write(conn)
+
+    def _on_readable(self, conn):
+        """read everything the peer sent and deliver the whole frames in it"""
+        while conn.sock is not None:
+            try:
+                nbytes = conn.sock.recv_into(self.recv_buffer)
+            except (SocketError, OSError) as e:
+                if getattr(e, 'errno', None) in (EAGAIN, EWOULDBLOCK):
+                    break
+                self._lost(conn)
+                return
+            if not nbytes:
+                self._lost(conn)  # hung up
+                return
+            conn.inbuf += self.recv_view[:nbytes]
+            if nbytes < self.recv_size:
+                break
+        self._read_frames(conn)
+
+    def _read_frames(self, conn):
+        data = conn.inbuf
+        unpack_from, header_size = self.FRAME.unpack_from, self.FRAME.size
+        pos, end = 0, len(data)
+        batch, batch_mac = [], None
+        while pos + header_size <= end:
+            length, mac_len = unpack_from(data, pos)
+            if length > self.max_frame:
+                self.log("got a corrupt frame, dropping the connection")
+                self._lost(conn)
+                return
+            start = pos + header_size
+            if start + mac_len + length > end:
+                break  # the rest of it hasn't arrived yet
+            mac = bytes(data[start:start + mac_len])
+            if mac != batch_mac and batch:
+                self.stats['received'] += len(batch)
+                self._deliver(batch, batch_mac.decode() or self.broadcast_addr)
+                batch = []
+            batch_mac = mac
+            batch.append(bytes(data[start + mac_len:start + mac_len + length]))
+            pos = start + mac_len + length
+        if batch:
+            self.stats['received'] += len(batch)
+            self._deliver(batch, batch_mac.decode() or self.broadcast_addr)
+        del data[:pos]
+
+    def _write(self, conn):
+        """hand the kernel as many queued frames as it will take, in as few syscalls as possible"""
+        outq = conn.outq
+        while outq and conn.connected:
+            bufs = [outq[i] for i in range(min(len(outq), self.max_iov))]
+            if conn.head_sent:
+                bufs[0] = memoryview(bufs[0])[conn.head_sent:]
+            try:
+                if HAS_SENDMSG:
+                    sent = conn.sock.sendmsg(bufs)
                 else:
-                    pass  # not meant for us, it was sent to a different port
+                    sent = conn.sock.send(b''.join(bufs))
+            except (SocketError, OSError) as e:
+                if getattr(e, 'errno', None) in (EAGAIN, EWOULDBLOCK, ENOBUFS):
+                    break
+                self._lost(conn)
+                return
+            conn.out_bytes -= sent
+            sent += conn.head_sent
+            while outq and sent >= len(outq[0]):
+                sent -= len(outq.popleft())
+            conn.head_sent = sent
+        if conn.sock is not None:
+            self.reactor.want_write(conn.sock, bool(outq))
 
     ### IO
 
-    def send(self, packet, retry=True):
-        """send a packet down the line to the inteface"""
-        addr = ('255.255.255.255', self.port)  # 255. is the broadcast IP for UDP
-        try:
-            self.send_socket.sendto(packet, addr)
-        except Exception as e:
-            self.log("Link failed to send packet over socket %s" % e)
-            sleep(0.2)
-            if retry:
-                self.send(packet, retry=False)
+    def send(self, packet, mac_addr=VirtualLink.broadcast_addr):
+        self.send_many((packet,), mac_addr)
+
+    def send_many(self, packets, mac_addr=VirtualLink.broadcast_addr):
+        """deliver packets to the nodes on this link, and queue them for every peer, they go out on the reactor thread"""
+        if not self.keep_listening:
+            self.log("is down.")
+            return
+        packets = list(packets)
+        self._deliver(packets, mac_addr)
+        mac = b'' if mac_addr == self.broadcast_addr else str(mac_addr).encode()
+        header = self.FRAME.pack
+        frames = [header(len(packet), len(mac)) + mac + packet for packet in packets]
+        with self._send_lock:
+            self.outq.extend(frames)
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        self.reactor.call_soon(self._flush)
+
+    def _flush(self):
+        with self._send_lock:
+            frames, self.outq = self.outq, []
+            self._flush_scheduled = False
+        if not frames:
+            return
+        self.stats['sent'] += len(frames)
+        size = sum(len(frame) for frame in frames)
+        for conn in self.connections:
+            if conn.out_bytes + size > self.max_backlog:
+                self.stats['backlog_dropped'] += len(frames)  # peer is down or too slow, don't let it use up all the memory
+                continue
+            conn.outq.extend(frames)
+            conn.out_bytes += size
+            if conn.connected:
+                self._write(conn)
+
+
+class TCPLink(StreamLink):
+    """Connects nodes on different hosts over persistent TCP connections, reliable and with no size limit on packets.
+    Listen on a port and/or dial some peers, every packet sent goes to all of them:
+      TCPLink('tcp1', port=2016)                              waits for peers to connect
+      TCPLink('tcp1', peers=[('10.0.0.5', 2016)])             connects to them, and reconnects if they go away
+    """
+    def __init__(self, name="tcp1", port=None, host='0.0.0.0', peers=(), **kwargs):
+        StreamLink.__init__(self, name=name, listen=(host, port) if port else None, peers=peers, **kwargs)
+
+    def _socket(self):
+        return socket(AF_INET, SOCK_STREAM)
+
+    def _listen(self, addr):
+        sock = socket(AF_INET, SOCK_STREAM)
+        sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        sock.bind(addr)
+        sock.listen(128)
+        return sock
+
+    def _setup(self, sock):
+        StreamLink._setup(self, sock)
+        sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)  # packets are already batched by the send queue, don't wait for more
+
+
+class UnixSocketLink(StreamLink):
+    """Connects nodes in different processes on the same host over unix domain sockets.
+      UnixSocketLink('ipc1', path='/tmp/mesh.sock')           listens on the path
+      UnixSocketLink('ipc1', peers=['/tmp/mesh.sock'])        connects to it
+      a, b = UnixSocketLink.pair()                            two links already connected with a socketpair()
+    """
+    def __init__(self, name="unix1", path=None, peers=(), **kwargs):
+        StreamLink.__init__(self, name=name, listen=path, peers=peers, **kwargs)
+
+    @classmethod
+    def pair(cls, names=("unix1", "unix2"), **kwargs):
+        left, right = socketpair(AF_UNIX, SOCK_STREAM)
+        links = cls(names[0], **kwargs), cls(names[1], **kwargs)
+        links[0].adopt(left)
+        links[1].adopt(right)
+        return links
+
+    def _socket(self):
+        return socket(AF_UNIX, SOCK_STREAM)
+
+    def _listen(self, path):
+        if os.path.exists(path):
+            os.unlink(path)  # left over from a link that didn't stop cleanly
+        sock = socket(AF_UNIX, SOCK_STREAM)
+        sock.bind(path)
+        sock.listen(128)
+        return sock
+
+    def stop(self):
+        StreamLink.stop(self)
+        if self.listen_addr and os.path.exists(self.listen_addr):
+            os.unlink(self.listen_addr)
+        return True
+
 
 class IRCLink(threading.Thread, VirtualLink):
     """This link connects to an IRC channel and uses it to simulate a BROADCAST connection over the internet.
-    Connect nodes on different computers to an IRCLink on the same channel and they will talk over the internet."""
-    def __init__(self, name='irc1', server='irc.freenode.net', port=6667, channel='##medusa', nick='bobbyTables'):
+    Connect nodes on different computers to an IRCLink on the same channel and they will talk over the internet.
+    Outgoing messages are queued and sent at the rate the server allows (a token bucket of flood_burst lines,
+    refilled at flood_rate lines per second), so a busy mesh doesn't get the link kicked for flooding.
+
+    With framing='base85' (or 'base64') packets can be any bytes: each line carries FRAME_MARKER and then the
+    encoded records of as many queued packets as fit in it, and packets too big for one line are split across several.
+    Plain text lines (e.g. from people in the channel) are still received as packets."""
+    FRAME_MARKER = b"~"
+    RECORD = struct.Struct('!BH')               # kind, length, then the data
+    WHOLE, MORE, LAST = 0, 1, 2                 # a whole packet, or a piece of one that continues in the next record
+    max_line = 512                              # max IRC line, including the CRLF
+    prefix_room = 100                           # what the server adds when relaying our line (":nick!user@host ")
+    max_reassembly = 1024 * 1024                # max bytes of a split packet to hold per sender
+
+    def __init__(self, name='irc1', server='irc.freenode.net', port=6667, channel='##medusa', nick='bobbyTables',
+                 flood_burst=5, flood_rate=0.5, max_queue=1024, framing=None):
         threading.Thread.__init__(self)
         VirtualLink.__init__(self, name=name)
         self.name = name
@@ -174,6 +1271,30 @@ class IRCLink(threading.Thread, VirtualLink):
         self.port = port
         self.channel = channel
         self.nick = nick if nick != 'bobbyTables' else 'bobbyTables' + str(randint(1, 1000))
+
+        # RFC 1459 8.10: servers let clients get 10 seconds ahead, at a cost of 2 seconds per message
+        self.flood_burst = flood_burst  # lines that can be sent back to back
+        self.flood_rate = flood_rate    # lines per second after that
+        self.tokens = flood_burst
+        self.last_refill = time()
+        self.max_queue = max_queue      # packets waiting to be sent past this are dropped
+        self.sendq = deque()
+
+        self.recv_buffer = bytearray(4096)  # reused for every read
+        self.recv_view = memoryview(self.recv_buffer)
+        self.partial = bytearray()          # the start of a line that hasn't been fully received yet
+        self.framing = framing
+        if framing:
+            self.encode, self.decode = {
+                'base85': (base64.b85encode, base64.b85decode),
+                'base64': (base64.b64encode, base64.b64decode),
+            }[framing]
+            room = self.max_line - len(('PRIVMSG %s :\r\n' % channel).encode('utf-8')) - self.prefix_room - len(self.FRAME_MARKER)
+            self.max_body = (room // 5 * 4) if framing == 'base85' else (room // 4 * 3)  # bytes that still fit once encoded
+        self.sending = None     # (kind, rest of the packet) that's partway through being split across lines
+        self.fragments = {}     # nick: pieces received so far of the packet they're splitting across lines
+
+        self.stats.update({'received': 0, 'sent': 0, 'lines_sent': 0, 'send_dropped': 0, 'bad_frames': 0})
         self.log("starting...")
         self._connect()
         self._join_channel()
@@ -187,16 +1308,45 @@ class IRCLink(threading.Thread, VirtualLink):
         VirtualLink.stop(self)
 
     def _parse_msg(self, msg):
-        if b"PRIVMSG" in msg:
-            from_nick = msg.split(b"PRIVMSG ",1)[0].split(b"!")[0][1:]              # who sent the PRIVMSG
-            to_nick = msg.split(b"PRIVMSG ",1)[1].split(b" :",1)[0]                 # where did they send it
-            text = msg.split(b"PRIVMSG ",1)[1].split(b" :",1)[1].strip()            # what did it contain
-            return (text, from_nick)
-        elif msg.find(b"PING :",0,6) != -1:                                         # was it just a ping?
-            from_srv = msg.split(b"PING :")[1].strip()                              # the source of the PING
-            return ("PING", from_srv)
+        """parse one IRC line (without the line ending): ":nick!user@host COMMAND params :trailing" """
+        prefix = b""
+        if msg[:1] == b":":
+            prefix, _, msg = msg[1:].partition(b" ")
+        command, _, params = msg.partition(b" ")
+        if command == b"PRIVMSG":
+            to_nick, _, text = params.partition(b" :")                              # where did they send it, and what did it contain
+            return (text.strip(), prefix.partition(b"!")[0])                        # who sent the PRIVMSG
+        elif command == b"PING":                                                    # was it just a ping?
+            return ("PING", params.lstrip(b":").strip())                            # the source of the PING
         return ("","")
 
+    def _read_lines(self, data):
+        """add newly received bytes to the buffer, and handle every complete line in it
+        one read can hold several lines, and the last one can be cut off halfway and finished by the next read
+        """
+        buf = self.partial
+        buf += data
+        packets, start = [], 0
+        while True:
+            end = buf.find(b"\n", start)
+            if end == -1:
+                break
+            line = bytes(buf[start:end]).rstrip(b"\r")
+            start = end + 1
+            packet, source = self._parse_msg(line)
+            if packet == "PING":
+                self._send_line(b"PONG :" + source + b"\r\n")  # don't let the rate limit get us timed out
+            elif self.framing and packet[:1] == self.FRAME_MARKER:
+                packets.extend(self._unframe(packet[1:], source))
+            elif packet:
+                packets.append(packet)
+        del buf[:start]
+        if len(buf) > 65536:
+            buf.clear()  # not IRC, or not a server that ever ends its lines
+        if packets:
+            self.stats['received'] += len(packets)
+            self._deliver(packets)  # put the packets in every mac_addr recv queue
+
     def _connect(self):
         self.log("connecting to server %s:%s..." % (self.server, self.port))
         self.net_socket = socket(AF_INET, SOCK_STREAM)
@@ -240,40 +1390,351 @@ class IRCLink(threading.Thread, VirtualLink):
         # we use a runloop instead of synchronous recv so stopping the connection mid-recv is possible
         self.net_socket.settimeout(0.05)
         while self.keep_listening:
+            self._send_queued()
             try:
-                packet = self.net_socket.recv(4096)
-            except:
-                packet = None
-            if packet:
-                packet, source = self._parse_msg(packet)
-                if packet == "PING":
-                    self.net_socket.send(b'PONG ' + source + b'\r')
-                elif packet:
-                    for mac_addr, recv_queue in self.inq.items():
-                        # put the packet in that mac_addr recv queue
-                        recv_queue.put(packet)
+                nbytes = self.net_socket.recv_into(self.recv_buffer)
+            except SocketTimeout:
+                continue
+            except (SocketError, OSError) as e:
+                self.log("lost the connection to the server %s" % e)
+                break
+            if not nbytes:
+                self.log("the server closed the connection")
+                break
+            self._read_lines(self.recv_view[:nbytes])
         self.log('is down.')
 
     ### IO
 
-    def send(self, packet, retry=True):
+    def send(self, packet):
         """send a packet down the line to the inteface"""
+        self.send_many((packet,))
+
+    def send_many(self, packets):
         if not self.keep_listening:
             self.log('is down.')
             return
+        packets = list(packets)
+        # (because the IRC server sees this link as 1 connection no matter how many nodes use it, it wont send enough copies of the packet back)
+        # for each node listening to this link object locally
+        self._deliver(packets)  # put the packet directly in their in queue
+        # then queue it to go down the wire to the IRC channel, the runloop sends it as soon as the rate limit allows
+        for packet in packets:
+            if len(self.sendq) >= self.max_queue:
+                self.stats['send_dropped'] += 1
+            else:
+                self.sendq.append(packet)
+
+    def _send_queued(self):
+        """send as many queued lines as the token bucket allows right now"""
+        now = time()
+        self.tokens = min(self.flood_burst, self.tokens + (now - self.last_refill) * self.flood_rate)
+        self.last_refill = now
+        while (self.sendq or self.sending) and self.tokens >= 1:
+            self.tokens -= 1
+            self._send_line(self._next_line())
+
+    def _next_line(self):
+        if self.framing:
+            text = self.FRAME_MARKER + self.encode(self._frame())
+        else:
+            text = self.sendq.popleft()
+            self.stats['sent'] += 1
+        return ('PRIVMSG %s :' % self.channel).encode('utf-8') + text + b'\r\n'
 
+    ### Framing
+
+    def _frame(self):
+        """pack queued packets into the body of one line, splitting the last one if it doesn't fit"""
+        records, room = [], self.max_body
+        record = self.RECORD.pack
+        header = self.RECORD.size
+        while room > header and (self.sending or self.sendq):
+            if self.sending:
+                kind, packet = self.sending
+                self.sending = None
+            else:
+                kind, packet = self.WHOLE, self.sendq.popleft()
+                self.stats['sent'] += 1
+            if header + len(packet) <= room:
+                records.append(record(kind, len(packet)) + packet)
+                room -= header + len(packet)
+            elif records and room < header + 64 and len(packet) < self.max_body - header:
+                self.sending = (kind, packet)  # not worth splitting to fill the last few bytes, it fits the next line whole
+                break
+            else:
+                # whatever doesn't fit continues in the next line, a WHOLE packet turns into MORE...LAST pieces
+                piece, rest = packet[:room - header], packet[room - header:]
+                records.append(record(self.MORE, len(piece)) + piece)
+                self.sending = (self.LAST, rest)
+                break
+        return b''.join(records)
+
+    def _unframe(self, text, source):
+        """decode a framed line and return the packets in it, stitching split ones back together"""
+        try:
+            body = self.decode(text)
+        except ValueError:
+            self.stats['bad_frames'] += 1
+            return []
+        packets, pos, end = [], 0, len(body)
+        unpack_from, header = self.RECORD.unpack_from, self.RECORD.size
+        while pos + header <= end:
+            kind, length = unpack_from(body, pos)
+            data = body[pos + header:pos + header + length]
+            pos += header + length
+            if len(data) != length:
+                self.stats['bad_frames'] += 1
+                break
+            if kind == self.WHOLE:
+                packets.append(data)
+            elif kind == self.MORE:
+                pieces = self.fragments.setdefault(source, bytearray())
+                if len(pieces) + length > self.max_reassembly:
+                    del self.fragments[source]
+                    self.stats['bad_frames'] += 1
+                else:
+                    pieces += data
+            elif kind == self.LAST and source in self.fragments:
+                packets.append(bytes(self.fragments.pop(source) + data))
+        return packets
+
+    def _send_line(self, line):
         try:
-            # (because the IRC server sees this link as 1 connection no matter how many nodes use it, it wont send enough copies of the packet back)
-            # for each node listening to this link object locally
-            for mac_addr, recv_queue in self.inq.items():
-                recv_queue.put(packet) # put the packet directly in their in queue
-            # then send it down the wire to the IRC channel
-            self.net_socket.send(('PRIVMSG %s :%s\r\n' % (self.channel, packet.decode())).encode('utf-8'))
-        except Exception as e:
+            self.net_socket.sendall(line)
+            self.stats['lines_sent'] += 1
+        except (SocketError, OSError) as e:
             self.log("Link failed to send packet over socket %s" % e)
-            sleep(0.2)
-            if retry:
-                self.send(packet, retry=False)
+
+
+class _UntrackedSegment(object):
+    """A shared memory segment created by another process, mapped the way SharedMemory does it but without registering it
+    with multiprocessing's resource tracker.  Registered segments get unlinked when we exit, and unregistering them again
+    isn't safe either: a forked child shares its parent's tracker, so it would drop the creator's registration.
+    """
+    def __init__(self, name):
+        import mmap
+        import _posixshmem
+        fd = _posixshmem.shm_open("/" + name, os.O_RDWR, mode=0o600)
+        try:
+            self._mmap = mmap.mmap(fd, os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
+        self.buf = memoryview(self._mmap)
+
+    def close(self):
+        self.buf.release()
+        self._mmap.close()
+
+
+class SharedMemoryLink(threading.Thread, VirtualLink):
+    """This link connects processes on the same host through rings of frames in shared memory (python3.8+).
+    Every SharedMemoryLink with the same name claims its own ring, and reads everyone's rings (including its own),
+    so every process sees every packet like on a BROADCAST link, without any syscalls or locks between processes.
+    Each ring only ever has one writer, and each reader keeps its own cursor, so readers never slow down the writer:
+    a reader that falls more than a ring behind skips ahead and counts the lost packets in stats['overruns'].
+    """
+    HEADER = struct.Struct('<QQQ')   # committed write position, ring capacity, closed flag
+    # the header's fields get updated one at a time: pack_into zeroes the bytes before filling them in,
+    # so rewriting the whole header let readers see a capacity of 0 or a torn write position in between
+    FIELD = struct.Struct('<Q')
+    FRAME = struct.Struct('<IB')     # frame length (including this header), destination mac length
+
+    def __init__(self, name="shm0", capacity=4 * 1024 * 1024, max_peers=16, poll_interval=0.001):
+        threading.Thread.__init__(self)
+        VirtualLink.__init__(self, name=name)
+        self.capacity = capacity
+        self.max_frame = capacity // 4   # bigger frames would leave too little room to detect a reader being overrun
+        self.max_peers = max_peers       # max number of processes that can share the link
+        self.poll_interval = poll_interval
+        self.stats.update({'sent': 0, 'received': 0, 'overruns': 0, 'send_dropped': 0})
+        self.write_pos = 0
+        self._write_lock = threading.Lock()  # only between threads in this process, no other process writes our ring
+        self.peers = {}                      # slot: [SharedMemory, read cursor]
+        self.ring, self.slot = self._claim_slot()
+
+    def __repr__(self):
+        return "<" + self.name + ">"
+
+    def _segment_name(self, slot):
+        return "mesh-%s-%s" % (self.name, slot)
+
+    def _claim_slot(self):
+        """create our ring in the first free slot, creating the segment fails if it exists so two processes never get the same one"""
+        from multiprocessing.shared_memory import SharedMemory
+        for slot in range(self.max_peers):
+            try:
+                ring = SharedMemory(name=self._segment_name(slot), create=True, size=self.HEADER.size + self.capacity)
+            except FileExistsError:
+                continue
+            self.HEADER.pack_into(ring.buf, 0, 0, self.capacity, 0)
+            return ring, slot
+        raise RuntimeError("All %s slots on %s are taken (segments left behind by crashed processes can be removed from /dev/shm)" % (self.max_peers, self))
+
+    def _attach(self, slot):
+        from multiprocessing import shared_memory
+        # the ring belongs to another process, python mustn't unlink it when we exit (it does by default before 3.13)
+        try:
+            try:
+                ring = shared_memory.SharedMemory(name=self._segment_name(slot), track=False)
+            except TypeError:
+                # windows doesn't have a resource tracker, on posix map it ourselves so it never gets registered
+                ring = _UntrackedSegment(self._segment_name(slot)) if os.name == 'posix' else shared_memory.SharedMemory(name=self._segment_name(slot))
+        except (FileNotFoundError, ValueError):
+            return None
+        position, capacity, closed = self.HEADER.unpack_from(ring.buf, 0)
+        if closed or not capacity:
+            ring.close()
+            return None
+        return [ring, position]  # start reading at what it writes next, not from the beginning of its history
+
+    def _scan_peers(self):
+        """look for rings of processes that joined since the last scan, and forget the ones that left"""
+        for slot in range(self.max_peers):
+            if slot == self.slot:
+                continue
+            peer = self.peers.get(slot)
+            if peer and self.HEADER.unpack_from(peer[0].buf, 0)[2]:
+                peer[0].close()
+                del self.peers[slot]
+                peer = None
+            if not peer:
+                peer = self._attach(slot)
+                if peer:
+                    self.peers[slot] = peer
+
+    @staticmethod
+    def _copy_in(buf, pos, data, capacity, offset):
+        start = pos % capacity
+        first = min(len(data), capacity - start)
+        buf[offset + start:offset + start + first] = data[:first]
+        if first < len(data):
+            buf[offset:offset + len(data) - first] = data[first:]
+
+    @staticmethod
+    def _copy_out(buf, pos, length, capacity, offset):
+        start = pos % capacity
+        first = min(length, capacity - start)
+        data = bytes(buf[offset + start:offset + start + first])
+        if first < length:
+            data += bytes(buf[offset:offset + length - first])
+        return data
+
+    ### Runloop
+
+    def run(self):
+        """runloop that reads new frames off all the rings into the inq buffer"""
+        self.peers[self.slot] = [self.ring, 0]
+        last_scan = 0
+        idle = 0
+        while self.keep_listening:
+            if time() - last_scan > 0.1:
+                self._scan_peers()
+                last_scan = time()
+            received = 0
+            for peer in list(self.peers.values()):
+                received += self._read_ring(peer)
+            if received:
+                idle = 0
+            else:
+                # back off from busy polling to poll_interval while the link is quiet
+                idle = min(idle * 2 or 0.00001, self.poll_interval)
+                sleep(idle)
+
+    def _read_ring(self, peer):
+        ring, cursor = peer
+        buf = ring.buf
+        committed, capacity, _ = self.HEADER.unpack_from(buf, 0)
+        if committed == cursor:
+            return 0
+        if committed - cursor > capacity:
+            # fell more than a whole ring behind, everything we haven't read has been overwritten already
+            self.stats['overruns'] += 1
+            peer[1] = committed
+            return 0
+
+        # copy everything new out in one go, then check the writer didn't lap us while we were copying
+        data = self._copy_out(buf, cursor, committed - cursor, capacity, self.HEADER.size)
+        peer[1] = committed
+        if self.HEADER.unpack_from(buf, 0)[0] + self.max_frame - capacity > cursor:
+            # the writer got into what we were copying, the frame lengths we'd walk through can't be trusted either
+            self.stats['overruns'] += 1
+            return 0
+
+        frames = []
+        unpack_from, header_size = self.FRAME.unpack_from, self.FRAME.size
+        pos, end = 0, len(data)
+        while pos < end:
+            length, mac_len = unpack_from(data, pos)
+            if length < header_size + mac_len or pos + length > end:
+                self.stats['overruns'] += 1  # corrupt, nothing after it can be trusted
+                break
+            start = pos + header_size
+            frames.append((data[start:start + mac_len], data[start + mac_len:pos + length]))
+            pos += length
+
+        # deliver runs of frames with the same destination in one batch
+        batch, batch_mac = [], None
+        for mac, packet in frames:
+            if mac != batch_mac and batch:
+                self._deliver(batch, batch_mac.decode() or self.broadcast_addr)
+                batch = []
+            batch_mac = mac
+            batch.append(packet)
+        if batch:
+            self._deliver(batch, batch_mac.decode() or self.broadcast_addr)
+        self.stats['received'] += len(frames)
+        return len(frames)
+
+    def stop(self):
+        VirtualLink.stop(self)
+        self.ring.buf[16:24] = self.FIELD.pack(1)  # tell the readers we're gone
+        for slot, peer in list(self.peers.items()):
+            if slot != self.slot:
+                peer[0].close()
+        self.peers = {}
+        self.ring.close()
+        self.ring.unlink()
+        return True
+
+    ### IO
+
+    def send(self, packet, mac_addr=VirtualLink.broadcast_addr):
+        """write a packet into our ring, every SharedMemoryLink with the same name will read it"""
+        self.send_many((packet,), mac_addr)
+
+    def send_many(self, packets, mac_addr=VirtualLink.broadcast_addr):
+        """write several frames, then commit them all at once so readers pick them up together"""
+        if not self.keep_listening:
+            self.log("is down.")
+            return
+        mac = b'' if mac_addr == self.broadcast_addr else str(mac_addr).encode()
+        buf, offset = self.ring.buf, self.HEADER.size
+        frame_header = self.FRAME.pack
+        chunk, chunk_size, sent = [], 0, 0
+        with self._write_lock:
+            for packet in packets:
+                length = self.FRAME.size + len(mac) + len(packet)
+                if length > self.max_frame:
+                    self.log("%s byte packet is too big (max %s bytes), dropped" % (len(packet), self.max_frame))
+                    self.stats['send_dropped'] += 1
+                    continue
+                if chunk_size + length > self.max_frame:
+                    # readers assume at most max_frame bytes are ever being written ahead of the commit
+                    self._write(b''.join(chunk))
+                    chunk, chunk_size = [], 0
+                chunk += (frame_header(length, len(mac)), mac, packet)
+                chunk_size += length
+                sent += 1
+            if chunk:
+                self._write(b''.join(chunk))
+        self.stats['sent'] += sent
+
+    def _write(self, data):
+        """copy frames into the ring, then commit them by moving the write position past them"""
+        self._copy_in(self.ring.buf, self.write_pos, data, self.capacity, self.HEADER.size)
+        self.write_pos += len(data)
+        self.ring.buf[0:8] = self.FIELD.pack(self.write_pos)
 
 class RawSocketLink(threading.Thread, VirtualLink):
     """This link uses tun/tap interfaces to send and receive packets directly at the ethernet level"""
@@ -3,15 +3,10 @@
 
 import random
 import threading
-import time
 from collections import defaultdict
 
-try:
-    from queue import Queue
-except ImportError:
-    from Queue import Queue
-
 from .filters import LoopbackFilter
+from .buffers import RingBuffer, DROP_TAIL
 
 # Physical Layer (copper, fiber, audio, wireless)
 # Link Layer (ethernet, ARP, PPP): links.py
@@ -21,7 +16,8 @@ from .filters import LoopbackFilter
 
 # Nodes connect to each other over links.  The node has a runloop that pulls packets off the link's incoming packet Queue,
 # runs them through its list of filters, then places it in the nodes incoming packet queue for that interface node.inq.
-# the Node's Program is has a seperate runloop in a different thread that is constantly calling node.inq.get().
+# The node doesn't poll: it subscribes a wakeup Event to each link, and sleeps until a link signals that a packet was queued for it.
+# the Node's Program is has a seperate runloop in a different thread that waits on node.inq_wakeup, then calls node.inq.get().
 # The program does something with the packet (like print it to the screen, or reply with "ACK"), and sends any outgoing responses
 # by calling the Node's send() method directly.  The Node runs the packet through it's outgoing packet filters in order, then
 # if it wasn't dropped, calls the network interface's .send() method to push it over the network.
@@ -36,16 +32,22 @@ class Node(threading.Thread):
         Programs process packets off the node's incoming queue, then send responses out through node's outbound filters,
         and finally out to the right network interface.
     """
-    def __init__(self, interfaces=None, name="n1", promiscuous=False, mac_addr=None, Filters=(), Program=None):
+    idle_timeout = 1.0  # max seconds to sleep without a wakeup before checking for new interfaces or a stop()
+    max_batch = 64      # max packets to pull off one interface before moving on to the next, so no link can starve the others
+
+    def __init__(self, interfaces=None, name="n1", promiscuous=False, mac_addr=None, Filters=(), Program=None, inq_size=1024, inq_policy=DROP_TAIL):
         threading.Thread.__init__(self)
         self.name = name
         self.interfaces = interfaces or []
         self.keep_listening = True
         self.promiscuous = promiscuous
         self.mac_addr = mac_addr or self._generate_MAC(6, 2)
-        self.inq = defaultdict(Queue)                                           # TODO: convert to bounded ring-buffer
+        self.inq = defaultdict(lambda: RingBuffer(inq_size, inq_policy))        # bounded, so a slow program drops packets instead of using up all the memory
         self.filters = [LoopbackFilter()] + [F() for F in Filters]              # initialize the filters that shape incoming and outgoing traffic before it hits the program
         self.program = Program(node=self) if Program else None                  # init the program that will be processing incoming packets
+        self.wakeup = threading.Event()                                         # set by the links whenever a packet is queued for this node
+        self.inq_wakeup = threading.Event()                                     # set whenever a packet is placed in self.inq, wakes up the program
+        self._subscribed = ()                                                   # interfaces that currently have our wakeup registered
 
     def __repr__(self):
         return "[{0}]".format(self.name)
@@ -66,8 +68,22 @@ class Node(threading.Thread):
         """stdout and stderr for the node"""
         print("%s %s" % (str(self).ljust(8), " ".join(str(x) for x in args)))
 
+    def inq_stats(self):
+        """totals of the enqueued/dropped packet counters across all the interface inqs"""
+        totals = defaultdict(int)
+        for inq in list(self.inq.values()):
+            for key, value in inq.stats.items():
+                totals[key] = max(totals[key], value) if key == 'high_water' else totals[key] + value
+        return dict(totals)
+
+    def start(self):
+        # attach to the links right away, so packets sent to us before the thread gets going aren't dropped
+        self._subscribe(self.interfaces)
+        threading.Thread.start(self)
+
     def stop(self):
         self.keep_listening = False
+        self.wakeup.set()
         if self.program:
             self.program.stop()
         self.join()
@@ -77,18 +93,58 @@ class Node(threading.Thread):
 
     def run(self):
         """runloop that gets triggered by node.start()
-        reads new packets off the link and feeds them to recv()
+        sleeps until a link wakes us up, then reads all the new packets off the links and feeds them to recv()
         """
         if self.program:
             self.program.start()
         while self.keep_listening:
-            for interface in self.interfaces:
-                packet = interface.recv(self.mac_addr if not self.promiscuous else "00:00:00:00:00:00")
-                if packet:
-                    self.recv(packet, interface)
-                time.sleep(0.01)
+            self.wakeup.clear()  # clear before draining, so packets that arrive mid-drain will wake us right back up
+            if not self.drain_all():
+                self.wakeup.wait(self.idle_timeout)
+        self._subscribe(())
         self.log("Stopped listening.")
 
+    def drain_all(self):
+        """drain a batch of packets off every interface, returns True if there may be more left on any of them"""
+        self._subscribe(self.interfaces)
+        pending = False
+        for interface in self.interfaces:
+            pending = self.drain(interface) or pending
+        return pending
+
+    def drain(self, interface, max_batch=None):
+        """read up to max_batch packets off an interface and feed them to recv(), returns True if there may be more left"""
+        max_batch = max_batch or self.max_batch
+        packets = interface.recv_many(self.mac_addr, max_batch)
+        if packets:
+            self.recv_batch(packets, interface)
+        return len(packets) == max_batch
+
+    def _subscribe(self, interfaces):
+        """register our wakeup with newly added interfaces, and remove it from ones we've been disconnected from"""
+        interfaces = tuple(interfaces)
+        if interfaces == self._subscribed:
+            return
+        for interface in set(self._subscribed) - set(interfaces):
+            interface.unsubscribe(self.wakeup, self.mac_addr)
+            interface.detach(self.mac_addr)
+        for interface in set(interfaces) - set(self._subscribed):
+            # attach first, so there's a queue for our packets before anyone is told we're listening
+            # owner=self: if the node gets garbage collected without being stopped, its queue on the link goes with it
+            # promiscuous nodes attach as taps, so they get their own copy of all the traffic on the link
+            interface.attach(self.mac_addr, owner=self, promiscuous=self.promiscuous)
+            interface.subscribe(self.wakeup, self.mac_addr)
+        self._subscribed = interfaces
+
+    def join_group(self, group_addr, interfaces=None):
+        """start getting the packets sent to a multicast group_addr on the given interfaces (default all)"""
+        for interface in (interfaces or self.interfaces):
+            interface.join_group(group_addr, self.mac_addr)
+
+    def leave_group(self, group_addr, interfaces=None):
+        for interface in (interfaces or self.interfaces):
+            interface.leave_group(group_addr, self.mac_addr)
+
     ### IO
 
     def recv(self, packet, interface):
@@ -101,7 +157,18 @@ class Node(threading.Thread):
         if packet:
             # if the packet wasn't dropped by a filter, log the recv and place it in the interface's inq
             # self.log("IN      ", str(interface).ljust(30), packet.decode())
-            self.inq[interface].put(packet)
+            self.inq[interface].put(packet, timeout=self.idle_timeout)  # the timeout only applies to the block policy
+            self.inq_wakeup.set()
+
+    def recv_batch(self, packets, interface):
+        """run a list of incoming packets through the filters together, then place the survivors in the inq"""
+        for f in self.filters:
+            if not packets:
+                return
+            packets = f.tr_many(packets, interface)
+        if packets:
+            self.inq[interface].put_many(packets, timeout=self.idle_timeout)  # the timeout only applies to the block policy
+            self.inq_wakeup.set()
 
     def send(self, packet, interfaces=None):
         """write packet to given interfaces, default is broadcast to all interfaces"""
@@ -115,3 +182,17 @@ class Node(threading.Thread):
                 # if not dropped, log the transmit and pass it to the interface's send method
                 # self.log("OUT     ", ("<"+",".join(i.name for i in interfaces)+">").ljust(30), packet.decode())
                 interface.send(packet)
+
+    def send_batch(self, packets, interfaces=None):
+        """write a list of packets to the given interfaces, default is broadcast to all interfaces"""
+        interfaces = interfaces or self.interfaces  # default to all interfaces
+        interfaces = interfaces if hasattr(interfaces, '__iter__') else [interfaces]
+
+        for interface in interfaces:
+            outgoing = list(packets)
+            for f in self.filters:
+                if not outgoing:
+                    break
+                outgoing = f.tx_many(outgoing, interface)  # run outgoing packets through the filters
+            if outgoing:
+                interface.send_many(outgoing)
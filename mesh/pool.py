@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# MIT License: Nick Sweeting
+
+# M:N scheduling: instead of 2 threads per node (one for the Node, one for its Program), nodes and programs are plain
+# objects and a fixed number of worker threads run their drain()/process() calls whenever their links or inqs have packets.
+# The thread count stays the same no matter how big the topology gets, and starting or stopping a node is just a function call.
+#
+#   pool = WorkerPool(workers=4)
+#   nodes = [PooledNode([lan], 'n%s' % i, pool, Program=Switch) for i in range(1000)]
+#   pool.start()
+#   [n.start() for n in nodes]
+
+import threading
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from .buffers import BLOCK
+from .node import Node
+
+
+class WorkerPool(object):
+    """A fixed number of worker threads that run submitted callbacks in the order they were submitted."""
+    def __init__(self, workers=4, name="pool"):
+        self.name = name
+        self.num_workers = workers
+        self.tasks = Queue()
+        self.workers = []
+
+    def __repr__(self):
+        return "<%s %s workers>" % (self.name, len(self.workers))
+
+    def start(self):
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self.work, name="%s-%s" % (self.name, i))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        return True
+
+    def stop(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        return True
+
+    def submit(self, callback, *args):
+        self.tasks.put((callback, args))
+
+    def work(self):
+        """worker runloop, runs tasks until it gets a None"""
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            callback, args = task
+            try:
+                callback(*args)
+            except Exception as e:
+                print("%s task %s failed: %r" % (self, callback, e))
+
+
+class PoolWakeup(object):
+    """A wakeup that links can .set() like a threading.Event, but that submits a callback to a WorkerPool instead.
+        The callback never runs on two workers at once, if it gets set while running it's run again right after,
+        so everything a node or program does stays in order.
+    """
+    def __init__(self, pool, callback):
+        self.pool = pool
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.scheduled = False  # waiting to be run by a worker
+        self.running = False    # currently being run by a worker
+
+    def is_set(self):
+        return self.scheduled
+
+    def set(self):
+        with self.lock:
+            if self.scheduled:
+                return
+            self.scheduled = True
+            if self.running:
+                return  # the worker running it now will resubmit it when it's done
+        self.pool.submit(self._run)
+
+    def clear(self):
+        self.scheduled = False
+
+    def _run(self):
+        with self.lock:
+            self.scheduled = False
+            self.running = True
+        try:
+            self.callback()
+        finally:
+            with self.lock:
+                self.running = False
+                again = self.scheduled
+            if again:
+                self.pool.submit(self._run)
+
+
+class PooledNode(Node):
+    """A Node whose runloop and Program are run by a WorkerPool's threads instead of their own.
+        The program is never started as a thread, the pool calls program.process() whenever the inq has packets.
+        Programs should avoid blocking, a program that sleeps holds on to a worker thread the whole time.
+    """
+    def __init__(self, interfaces=None, name="n1", pool=None, **kwargs):
+        if kwargs.get('inq_policy') == BLOCK:
+            raise ValueError('PooledNode inqs cant use the block policy, blocked workers could deadlock the pool')
+        Node.__init__(self, interfaces, name, **kwargs)
+        self.pool = pool
+        self.wakeup = PoolWakeup(pool, self._on_wakeup)
+        self.inq_wakeup = PoolWakeup(pool, self._on_inq_wakeup)
+
+    def start(self):
+        self.keep_listening = True
+        self._subscribe(self.interfaces)
+        self.wakeup.set()  # pick up anything that was sent before we started
+        return True
+
+    def stop(self):
+        self.keep_listening = False
+        self._subscribe(())
+        if self.program:
+            self.program.keep_listening = False
+        return True
+
+    def is_alive(self):
+        return self.keep_listening
+
+    def _on_wakeup(self):
+        """a link has packets for us, drain a batch like Node.run would"""
+        if self.keep_listening and self.drain_all():
+            self.wakeup.set()  # go to the back of the line for the rest, so other nodes get a turn
+
+    def _on_inq_wakeup(self):
+        """there are packets in the inq, let the program handle a round of them"""
+        program = self.program
+        if program and program.keep_listening and program.process():
+            self.inq_wakeup.set()
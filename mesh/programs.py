@@ -1,7 +1,7 @@
 import re
 import os
+import time
 import threading
-from time import sleep
 
 try:
     from queue import Empty
@@ -11,40 +11,85 @@ except ImportError:
 from .routers import MessageRouter
 
 
+class WallClock(object):
+    """The clock programs use for time(), sleep() and timers by default, simulations swap in a virtual one."""
+    sleep = staticmethod(time.sleep)
+    time = staticmethod(time.time)  # (has to come last, it shadows the time module in the class body)
+
+    @staticmethod
+    def call_later(delay, callback, *args):
+        """run callback(*args) in delay seconds, returns a timer that can be .cancel()ed"""
+        timer = threading.Timer(delay, callback, args)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+
 class BaseProgram(threading.Thread):
     """Represents a program running on a Node that interprets and responds to incoming packets."""
+    idle_timeout = 1.0  # max seconds to sleep without a wakeup before checking for a stop()
+    max_batch = 16      # max packets handled from one interface per round before moving on to the next one
+    weights = None      # {interface: weight}, an interface gets max_batch * weight packets per round (default weight is 1)
+    clock = WallClock   # use self.clock.time(), self.sleep() and self.call_later() so programs also work in simulations
+
     def __init__(self, node):
         threading.Thread.__init__(self)
         self.keep_listening = True
         self.node = node
 
     def run(self):
-        """runloop that reads packets off the node's incoming packet buffer (node.inq)"""
+        """runloop that sleeps until the node puts packets in its incoming packet buffer (node.inq), then handles them"""
+        wakeup = self.node.inq_wakeup
         while self.keep_listening:
-            for interface in self.node.interfaces:
-                try:
-                    self.recv(self.node.inq[interface].get(timeout=0), interface)
-                except Empty:
-                    sleep(0.01)
+            wakeup.clear()  # clear before processing, so packets that arrive mid-round will wake us right back up
+            if not self.process():
+                wakeup.wait(self.idle_timeout)
+
+    def process(self):
+        """handle one weighted round-robin round of packets across all the node's interfaces
+        returns True if an interface used up its whole quota, i.e. there may be more packets waiting
+        """
+        pending = False
+        for interface in list(self.node.interfaces):
+            quota = self.max_batch * (self.weights.get(interface, 1) if self.weights else 1)
+            packets = self.node.inq[interface].get_many(quota)
+            if packets:
+                self.recv_batch(packets, interface)
+            if len(packets) == quota:
+                pending = True
+        return pending
 
     def stop(self):
         self.keep_listening = False
+        self.node.inq_wakeup.set()
         self.join()
 
     def recv(self, packet, interface):
         """overload this and put logic here to actually do something with the packet"""
         pass
 
+    def recv_batch(self, packets, interface):
+        """called with a list of packets that arrived on the same interface, overload it to handle them all at once"""
+        for packet in packets:
+            self.recv(packet, interface)
+
+    def sleep(self, seconds):
+        self.clock.sleep(seconds)
+
+    def call_later(self, delay, callback, *args):
+        """timer that runs callback(*args) in delay seconds, returns a handle with .cancel()"""
+        return self.clock.call_later(delay, callback, *args)
+
 class Printer(BaseProgram):
     """A simple program to just print incoming packets to the console."""
     def recv(self, packet, interface):
-        sleep(0.2)  # nicety so that printers print after all the debug statements
+        self.sleep(0.2)  # nicety so that printers print after all the debug statements
         self.node.log(("\nPRINTER  %s" % interface).ljust(39), packet.decode())
 
 class Switch(BaseProgram):
     """A switch that routes a packet coming in on any interface to all the other interfaces."""
     def recv(self, packet, interface):
-        other_ifaces = set(self.node.interfaces) - {interface}
+        other_ifaces = [i for i in self.node.interfaces if i is not interface]  # keeps the interface order, so simulations are repeatable
         if packet and other_ifaces:
             self.node.log("SWITCH  ", (str(interface)+" >>>> <"+','.join(i.name for i in other_ifaces)+">").ljust(30), packet.decode())
             self.node.send(packet, interfaces=other_ifaces)
@@ -124,14 +169,13 @@ class RedisProgram(BaseProgram):
         print('[√] Redis program is buffering IO to db:{0} keys:{1} & {2}.'.format(
             0, self.recv_key, self.send_key))
 
+        wakeup = self.node.inq_wakeup
         while self.keep_listening:
-            for interface in self.node.interfaces:
-                if self.get_recvs(interface):
-                    continue
-                if self.put_sends():
-                    continue
-
-                sleep(0.01)
+            wakeup.clear()
+            busy = self.process()
+            busy = self.put_sends() or busy
+            if not busy:
+                wakeup.wait(0.01)  # redis can't wake us up, so keep polling it for sends
 
     def recv(self, packet, interface):
         print('[IN]:  {}'.format(packet))
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# MIT License: Nick Sweeting
+
+# Shared I/O thread for socket links (python3 only).  Normally every UDPLink is its own thread, looping on select() over
+# its one socket.  Give the links a Reactor instead, and they become passive objects: the reactor waits on all of their
+# sockets at once with the best selector the OS has (epoll, kqueue, ...), and calls a link's read handler when its socket
+# has datagrams.  The thread count stays at one no matter how many ports a process bridges, and idle links cost nothing.
+# It also runs timers (call_later), which the links use to flush their send queues.
+#
+#   reactor = Reactor()
+#   links = [UDPLink('en%s' % i, 2010 + i, reactor=reactor) for i in range(32)]
+#   reactor.start()
+#   [link.start() for link in links]
+#
+# A link that isn't given a reactor makes a private one and runs it in its own thread, with run() instead of start().
+
+import heapq
+import itertools
+import threading
+import selectors
+from time import time
+from collections import deque
+from socket import socketpair
+
+
+class Reactor(threading.Thread):
+    """One thread that waits for any of the registered sockets to be readable, then runs its callback.
+        Callbacks run on the reactor thread, so they should read what's ready and return without blocking.
+    """
+    def __init__(self, name="reactor"):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.keep_listening = True
+        self.selector = selectors.DefaultSelector()
+        self.pending = deque()  # changes to the registered sockets, applied by the reactor thread between selects
+        self.timers = []        # heap of [when, seq, callback, args], only touched by the reactor thread
+        self.counter = itertools.count()
+        self.thread_id = None   # the thread running the loop, either our own or one that called run() directly
+        self.finished = False   # the loop is done, callbacks from other threads aren't accepted anymore
+        self.done = threading.Event()
+        self._pending_lock = threading.Lock()
+        self.stats = {'wakeups': 0, 'dispatched': 0}
+
+        # writing a byte to the waker interrupts select(), so register/unregister/stop take effect right away
+        self._waker, self._waker_send = socketpair()
+        self._waker.setblocking(0)
+        self._waker_send.setblocking(0)
+        self.selector.register(self._waker, selectors.EVENT_READ, (self._drain_waker, None))
+
+    def __repr__(self):
+        return "<%s %s sockets>" % (self.name, len(self.selector.get_map()) - 1)
+
+    def stop(self):
+        self.keep_listening = False
+        self._wake()
+        if self.is_alive() or (self.thread_id is not None and self.thread_id != threading.get_ident()):
+            self.done.wait()
+        with self._pending_lock:
+            self.finished = True  # in case it was never run
+        self.selector.close()
+        self._waker.close()
+        self._waker_send.close()
+        return True
+
+    ### Registration
+
+    def register(self, fileobj, callback, on_writable=None):
+        """call callback() on the reactor thread whenever fileobj is readable,
+        and on_writable() whenever it's writable, while want_write() is on for it
+        """
+        self.call_soon(self.selector.register, fileobj, selectors.EVENT_READ, (callback, on_writable))
+
+    def want_write(self, fileobj, wanted=True):
+        """turn on or off waiting for fileobj to be writable, e.g. while it has a backlog of data the kernel wouldn't take"""
+        self.call_soon(self._want_write, fileobj, wanted)
+
+    def _want_write(self, fileobj, wanted):
+        try:
+            key = self.selector.get_key(fileobj)
+        except (KeyError, ValueError):
+            return  # unregistered in the meantime
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if wanted else 0)
+        if key.events != events:
+            self.selector.modify(fileobj, events, key.data)
+
+    def unregister(self, fileobj):
+        """stop watching fileobj, once this returns its callback won't be called again (unless called from a callback)"""
+        done = threading.Event()
+        if self.call_soon(self._unregister, fileobj, done) and self.thread_id not in (None, threading.get_ident()):
+            done.wait(1)
+
+    def _unregister(self, fileobj, done):
+        try:
+            self.selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass  # never registered, or already closed
+        done.set()
+
+    def call_soon(self, callback, *args):
+        """run callback(*args) on the reactor thread before it goes back to waiting (right away if this is the reactor thread)
+        callbacks from before the reactor starts are run first thing once it does,
+        returns False if the reactor has already stopped and the callback will never run
+        """
+        if self.thread_id == threading.get_ident():
+            callback(*args)
+            return True
+        with self._pending_lock:
+            if self.finished:
+                return False
+            self.pending.append((callback, args))
+        self._wake()
+        return True
+
+    def call_later(self, delay, callback, *args):
+        """run callback(*args) on the reactor thread in delay seconds, returns a timer that can be cancel()ed"""
+        timer = [time() + delay, next(self.counter), callback, args]
+        self.call_soon(heapq.heappush, self.timers, timer)
+        return timer
+
+    @staticmethod
+    def cancel(timer):
+        timer[2] = None  # cancelled timers are left in the heap and skipped when they come up
+
+    ### Runloop
+
+    def run(self):
+        """wait for sockets to become readable and dispatch them to their callbacks, until stop()"""
+        self.thread_id = threading.get_ident()
+        while self.keep_listening:
+            self._run_pending()
+            events = self.selector.select(self._run_timers())
+            self.stats['wakeups'] += 1
+            for key, mask in events:
+                self.stats['dispatched'] += 1
+                on_readable, on_writable = key.data
+                try:
+                    if mask & selectors.EVENT_WRITE and on_writable:
+                        on_writable()
+                    if mask & selectors.EVENT_READ and on_readable:
+                        on_readable()
+                except Exception as e:
+                    print("%s callback for %s failed: %r" % (self, key.fileobj, e))
+        with self._pending_lock:
+            self.finished = True  # nothing else can be queued, so this is the last of it
+        self._run_pending()
+        self.thread_id = None
+        self.done.set()
+
+    def _run_pending(self):
+        """run the callbacks queued with call_soon"""
+        while self.pending:
+            callback, args = self.pending.popleft()
+            try:
+                callback(*args)
+            except Exception as e:
+                print("%s callback %s failed: %r" % (self, callback, e))
+
+    def _run_timers(self):
+        """run the timers that are due, returns how long until the next one (None if there aren't any)"""
+        while self.timers:
+            now = time()
+            when, _, callback, args = self.timers[0]
+            if when > now:
+                return when - now
+            heapq.heappop(self.timers)
+            if callback is not None:
+                try:
+                    callback(*args)
+                except Exception as e:
+                    print("%s timer %s failed: %r" % (self, callback, e))
+        return None
+
+    def _wake(self):
+        try:
+            self._waker_send.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # waker buffer is full or closed, the reactor is getting woken up anyway
+
+    def _drain_waker(self):
+        try:
+            while self._waker.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
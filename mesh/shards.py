@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+# MIT License: Nick Sweeting
+
+# Sharded simulations: split one big topology of Nodes and VirtualLinks across several processes so it can use every core.
+# Each shard process runs its share of the nodes as PooledNodes.  A link with members in more than one shard becomes a
+# ShardLink in each of them: local traffic is delivered directly like a VirtualLink, and a copy is queued for the other
+# shards, which a flusher thread sends over a pipe in batches every flush_interval seconds.
+#
+#   sim = ShardedSimulation(shards=8)
+#   sim.add_link('vl1')
+#   sim.add_node('n1', ['vl1'], Program=Switch, Filters=(UniqueFilter,))
+#   ...
+#   sim.start()
+#   sim.send('n1', b'hello')
+#   results = sim.stop()   # {'nodes': {'n1': {...}, ...}, 'shards': [{...}, ...]}
+#
+# Programs, Filters and collect functions get sent to the shard processes, so they have to be importable (not lambdas).
+
+import time
+import threading
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+from .buffers import Channel
+from .links import VirtualLink
+from .node import Node
+from .pool import WorkerPool, PooledNode
+
+
+def default_collect(node):
+    """what gets sent back to the parent process for each node when the simulation stops"""
+    return {'inq_stats': node.inq_stats()}
+
+
+class ShardLink(VirtualLink):
+    """A VirtualLink with members in other shards, every packet sent on it also gets queued for the shards that need a copy."""
+    def __init__(self, name, shard, remote_shards, mac_shards):
+        VirtualLink.__init__(self, name=name)
+        self.shard = shard
+        self.remote_shards = remote_shards      # shards with members of this link
+        self.mac_shards = mac_shards            # mac_addr: shard of every member of this link
+        self.promiscuous_shards = ()            # shards with promiscuous members, they get a copy of the unicast traffic too
+
+    def log(self, *args):
+        pass  # a thousand shards x links saying "ready." isn't useful
+
+    def _deliver(self, packets, mac_addr=VirtualLink.broadcast_addr):
+        packets = list(packets)
+        VirtualLink._deliver(self, packets, mac_addr)
+        if mac_addr == self.broadcast_addr or mac_addr not in self.mac_shards:
+            # multicast groups are joined in each shard separately, so let every shard look the group up itself
+            to_shards = self.remote_shards
+        else:
+            to_shards = set(self.promiscuous_shards)
+            if self.mac_shards[mac_addr] != self.shard.index:
+                to_shards.add(self.mac_shards[mac_addr])
+        for index in to_shards:
+            self.shard.outboxes[index].put((self.name, mac_addr, packets))
+
+
+class Shard(object):
+    """The part of the topology that runs in one process (this object lives in the shard process)."""
+    def __init__(self, index, spec, outbound, inbound, workers=1, flush_interval=0.002):
+        self.index = index
+        self.outbound = outbound                # shard index: Connection to send batches to it
+        self.inbound = list(inbound)            # Connections other shards send us batches on
+        self.outboxes = {i: Channel() for i in outbound}
+        self.flush_interval = flush_interval
+        self.flushing = True
+        self.keep_listening = True
+        self.pool = WorkerPool(workers, name="shard%s" % index)
+        self.stats = {'sent_batches': 0, 'sent_packets': 0, 'recv_batches': 0, 'recv_packets': 0}
+
+        owner = spec['owner']
+        local = [name for name, shard in owner.items() if shard == index]
+        macs = {name: spec['nodes'][name]['mac_addr'] for name in owner}
+
+        self.links = {}
+        for link_name, members in spec['links'].items():
+            shards = set(owner[m] for m in members)
+            if index not in shards:
+                continue
+            if len(shards) > 1:
+                link = ShardLink(link_name, self, shards - {index}, {macs[m]: owner[m] for m in members})
+                link.promiscuous_shards = set(owner[m] for m in members if spec['nodes'][m]['kwargs'].get('promiscuous')) - {index}
+            else:
+                link = VirtualLink(link_name)
+                link.log = lambda *args: None
+            self.links[link_name] = link
+
+        self.nodes = {}
+        for name in local:
+            node = spec['nodes'][name]
+            self.nodes[name] = PooledNode(
+                [self.links[l] for l in node['links']], name, self.pool,
+                mac_addr=node['mac_addr'], **node['kwargs']
+            )
+
+    def start(self):
+        self.pool.start()
+        [node.start() for node in self.nodes.values()]
+        self.flusher = threading.Thread(target=self.flush_loop, name="shard%s-flush" % self.index)
+        self.receiver = threading.Thread(target=self.recv_loop, name="shard%s-recv" % self.index)
+        self.flusher.start()
+        self.receiver.start()
+
+    def stop(self, collect=default_collect):
+        """stop the nodes and send out the last batches, but keep reading until close() so other shards never block on us"""
+        [node.stop() for node in self.nodes.values()]
+        self.pool.stop()
+        self.flushing = False
+        self.flusher.join()
+        self.flush()
+        return {name: collect(node) for name, node in self.nodes.items()}
+
+    def close(self):
+        self.keep_listening = False
+        self.receiver.join()
+        for conn in list(self.outbound.values()) + self.inbound:
+            conn.close()
+
+    def flush(self):
+        for index, outbox in self.outboxes.items():
+            batch = outbox.get_many()
+            if batch:
+                self.outbound[index].send(batch)
+                self.stats['sent_batches'] += 1
+                self.stats['sent_packets'] += sum(len(packets) for _, _, packets in batch)
+
+    def flush_loop(self):
+        """send whatever was queued for the other shards every flush_interval"""
+        while self.flushing:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def recv_loop(self):
+        """deliver the batches other shards send us to the local members of the link"""
+        while self.keep_listening and self.inbound:
+            for conn in wait(self.inbound, timeout=0.1):
+                try:
+                    batch = conn.recv()
+                except EOFError:
+                    self.inbound.remove(conn)
+                    continue
+                self.stats['recv_batches'] += 1
+                for link_name, mac_addr, packets in batch:
+                    # deliver locally only, the sender already sent a copy to every shard that needs one
+                    VirtualLink._deliver(self.links[link_name], packets, mac_addr)
+                    self.stats['recv_packets'] += len(packets)
+
+
+def _run_shard(index, spec, outbound, inbound, control, workers, flush_interval, collect):
+    """entrypoint of a shard process, builds the shard then runs the commands the parent sends over control"""
+    shard = Shard(index, spec, outbound, inbound, workers, flush_interval)
+    shard.start()
+    while True:
+        command, args = control.recv()
+        if command == 'send':
+            name, packet, interfaces = args
+            node = shard.nodes[name]
+            node.send(packet, [shard.links[l] for l in interfaces] if interfaces else None)
+        elif command == 'stats':
+            control.send(dict(shard.stats))
+        elif command == 'stop':
+            results = shard.stop(collect)
+            control.send((results, dict(shard.stats)))
+        elif command == 'exit':
+            shard.close()
+            return
+
+
+class ShardedSimulation(object):
+    """A topology of nodes and links that gets partitioned across a pool of processes."""
+    def __init__(self, shards=None, workers=1, flush_interval=0.002, collect=default_collect):
+        self.num_shards = shards or multiprocessing.cpu_count()
+        self.workers = workers                  # WorkerPool threads per shard, more than 1 rarely helps because of the GIL
+        self.flush_interval = flush_interval    # how often shards send each other their queued packets
+        self.collect = collect                  # collect(node) -> picklable results, run in the shard when it stops
+        self.links = {}                         # link name: [node names]
+        self.nodes = {}                         # node name: spec
+        self.owner = None                       # node name: shard index
+        self.processes = []
+        self.controls = []
+
+    def __repr__(self):
+        return "<ShardedSimulation %s nodes %s links %s shards>" % (len(self.nodes), len(self.links), self.num_shards)
+
+    def add_link(self, name):
+        self.links.setdefault(name, [])
+
+    def add_node(self, name, links, mac_addr=None, **kwargs):
+        """add a node connected to the given link names, kwargs are passed on to Node(), e.g. Program=, Filters="""
+        for link in links:
+            self.links.setdefault(link, []).append(name)
+        self.nodes[name] = {
+            'links': list(links),
+            'mac_addr': mac_addr or Node._generate_MAC(6, 2),
+            'kwargs': kwargs,
+        }
+
+    def partition(self):
+        """assign nodes to shards by walking the topology breadth-first and cutting it into equal chunks,
+        so nodes that share links mostly end up in the same shard
+        """
+        order, seen = [], set()
+        for start in self.nodes:
+            if start in seen:
+                continue
+            seen.add(start)
+            queue = deque([start])
+            while queue:
+                name = queue.popleft()
+                order.append(name)
+                for link in self.nodes[name]['links']:
+                    for neighbor in self.links[link]:
+                        if neighbor not in seen:
+                            seen.add(neighbor)
+                            queue.append(neighbor)
+        chunk_size = -(-len(order) // self.num_shards)  # ceil
+        return {name: i // chunk_size for i, name in enumerate(order)}
+
+    def start(self, owner=None):
+        """start the shard processes, pass owner={node name: shard index} to choose the partitioning yourself"""
+        self.owner = owner or self.partition()
+        num_shards = max(self.owner.values()) + 1
+        spec = {'owner': self.owner, 'links': self.links, 'nodes': self.nodes}
+
+        # one one-way pipe for each (sender, receiver) pair of shards
+        outbound = [{} for _ in range(num_shards)]
+        inbound = [[] for _ in range(num_shards)]
+        for i in range(num_shards):
+            for j in range(num_shards):
+                if i != j:
+                    recv_end, send_end = multiprocessing.Pipe(duplex=False)
+                    outbound[i][j] = send_end
+                    inbound[j].append(recv_end)
+
+        for i in range(num_shards):
+            control, child_control = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_run_shard,
+                args=(i, spec, outbound[i], inbound[i], child_control, self.workers, self.flush_interval, self.collect),
+                name="shard%s" % i,
+            )
+            process.start()
+            self.processes.append(process)
+            self.controls.append(control)
+
+        # the children have their own copies of the pipe ends now
+        for ends in outbound:
+            [conn.close() for conn in ends.values()]
+        for ends in inbound:
+            [conn.close() for conn in ends]
+        return True
+
+    def send(self, name, packet, interfaces=None):
+        """have a node send a packet, optionally only out of the given link names"""
+        self.controls[self.owner[name]].send(('send', (name, packet, interfaces)))
+
+    def stats(self):
+        """counters of the batches and packets each shard has sent and received"""
+        for control in self.controls:
+            control.send(('stats', ()))
+        return [control.recv() for control in self.controls]
+
+    def stop(self):
+        """stop all the shards, returns {'nodes': {name: collect(node)}, 'shards': [stats, ...]}"""
+        for control in self.controls:
+            control.send(('stop', ()))
+        results = {'nodes': {}, 'shards': []}
+        for control in self.controls:
+            nodes, stats = control.recv()
+            results['nodes'].update(nodes)
+            results['shards'].append(stats)
+        # only exit once every shard has sent its last batches, so nobody is left writing to a pipe that isn't being read
+        for control in self.controls:
+            control.send(('exit', ()))
+        for process in self.processes:
+            process.join()
+        self.processes, self.controls = [], []
+        return results
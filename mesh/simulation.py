@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# MIT License: Nick Sweeting
+
+# Discrete-event simulation: instead of threads sleeping on the wall clock, everything that happens in the network is an
+# event on a single virtual clock.  Link deliveries, node and program wakeups, timers and sleeps get pushed onto a
+# priority queue, and the Scheduler runs them in time order, jumping straight from one event to the next.
+# A 10 minute scenario runs as fast as the events can be processed, and (with random.seed() set) gives the same results every run.
+#
+#   sim = Scheduler()
+#   lan = SimLink('lan', sim, latency=0.005)
+#   nodes = [SimNode([lan], 'n%s' % i, sim, Program=Switch) for i in range(100)]
+#   [n.start() for n in nodes]
+#   sim.call_at(1.0, nodes[0].send, b'hello')
+#   sim.run(until=600)
+
+import heapq
+import itertools
+
+from .buffers import BLOCK
+from .links import VirtualLink
+from .node import Node
+
+
+class Scheduler(object):
+    """A virtual clock and a priority queue of the events scheduled to run on it."""
+    def __init__(self, start=0.0):
+        self.now = start
+        self.events = []                  # heap of [when, seq, callback, args]
+        self.counter = itertools.count()  # tie breaker, so events at the same instant run in the order they were scheduled
+        self.processed = 0
+
+    def __len__(self):
+        return len(self.events)
+
+    def time(self):
+        return self.now
+
+    def call_at(self, when, callback, *args):
+        """schedule callback(*args) at virtual time when, returns an event that can be cancel()ed"""
+        event = [max(when, self.now), next(self.counter), callback, args]
+        heapq.heappush(self.events, event)
+        return event
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.now + delay, callback, *args)
+
+    @staticmethod
+    def cancel(event):
+        event[2] = None  # cancelled events are left in the heap and skipped when they come up
+
+    def step(self):
+        """jump the clock to the next event and run it, returns False if there are no events left"""
+        while self.events:
+            when, _, callback, args = heapq.heappop(self.events)
+            if callback is None:
+                continue
+            self.now = when
+            self.processed += 1
+            callback(*args)
+            return True
+        return False
+
+    def run(self, until=None, max_events=None):
+        """run events in order until there are none left, the clock passes until, or max_events have run"""
+        count = 0
+        while self.events and (max_events is None or count < max_events):
+            if until is not None and self.events[0][0] > until:
+                break
+            if not self.step():
+                break
+            count += 1
+        if until is not None and self.now < until:
+            self.now = until
+        return count
+
+
+class SimWakeup(object):
+    """A wakeup that links can .set() like a threading.Event, but that schedules a callback on the virtual clock instead."""
+    def __init__(self, scheduler, callback):
+        self.scheduler = scheduler
+        self.callback = callback
+        self.flag = False
+
+    def is_set(self):
+        return self.flag
+
+    def set(self, delay=0):
+        if not self.flag:
+            self.flag = True
+            self.scheduler.call_later(delay, self.callback)
+
+    def clear(self):
+        self.flag = False
+
+
+class ProgramClock(object):
+    """The clock a program on a SimNode uses for time(), sleep() and call_later().
+        There's no way to pause a handler halfway on a single clock, so sleep() makes the program busy instead:
+        the time it slept for gets added on, and the program's next packets are handled that much later.
+    """
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.busy = 0.0  # seconds slept during the current handler call
+
+    def time(self):
+        return self.scheduler.now + self.busy
+
+    def sleep(self, seconds):
+        self.busy += seconds
+
+    def call_later(self, delay, callback, *args):
+        return self.scheduler.call_later(self.busy + delay, callback, *args)
+
+
+class SimLink(VirtualLink):
+    """A VirtualLink that delivers packets as events on the virtual clock, latency seconds after they're sent."""
+    def __init__(self, name="vlan1", scheduler=None, latency=0.0):
+        VirtualLink.__init__(self, name=name)
+        self.scheduler = scheduler
+        self.latency = latency
+
+    def log(self, *args):
+        VirtualLink.log(self, "%.6f" % self.scheduler.now, *args)
+
+    def _deliver(self, packets, mac_addr=VirtualLink.broadcast_addr):
+        self.scheduler.call_later(self.latency, VirtualLink._deliver, self, list(packets), mac_addr)
+
+
+class SimNode(Node):
+    """A Node that gets run by a Scheduler's events on the virtual clock instead of by its own thread.
+        Its program is never started as a thread either, the node calls program.process() whenever the inq has packets.
+    """
+    def __init__(self, interfaces=None, name="n1", scheduler=None, **kwargs):
+        if kwargs.get('inq_policy') == BLOCK:
+            raise ValueError('SimNode inqs cant use the block policy, blocking the sender would stop the whole simulation')
+        Node.__init__(self, interfaces, name, **kwargs)
+        self.scheduler = scheduler
+        self.wakeup = SimWakeup(scheduler, self._on_wakeup)
+        self.inq_wakeup = SimWakeup(scheduler, self._on_inq_wakeup)
+        if self.program:
+            self.program.clock = ProgramClock(scheduler)
+        for f in self.filters:
+            if hasattr(f, 'clock'):
+                f.clock = scheduler.time  # filters that forget things after a while have to age them on the virtual clock
+
+    def log(self, *args):
+        Node.log(self, "%.6f" % self.scheduler.now, *args)
+
+    def start(self):
+        self.keep_listening = True
+        self._subscribe(self.interfaces)
+        self.wakeup.set()  # pick up anything that was sent before we started
+        return True
+
+    def stop(self):
+        self.keep_listening = False
+        self._subscribe(())
+        if self.program:
+            self.program.keep_listening = False
+        return True
+
+    def is_alive(self):
+        return self.keep_listening
+
+    def _on_wakeup(self):
+        """event: a link has packets for us, drain them like Node.run would"""
+        if not self.keep_listening:
+            return
+        self.wakeup.clear()
+        if self.drain_all():
+            self.wakeup.set()  # come back for the rest after the other events at this instant
+
+    def _on_inq_wakeup(self):
+        """event: there are packets in the inq, let the program handle a round of them"""
+        program = self.program
+        if not program or not program.keep_listening:
+            return
+        self.inq_wakeup.clear()
+        program.clock.busy = 0.0
+        pending = program.process()
+        busy, program.clock.busy = program.clock.busy, 0.0
+        if pending or busy:
+            # leave the wakeup set while the program is busy, so new packets don't get handled before it's done sleeping
+            self.inq_wakeup.set(delay=busy)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# MIT License: Nick Sweeting
+
+#   python3 -m unittest mesh.tests.test_buffers
+
+import random
+import threading
+import unittest
+from time import time
+
+from mesh.buffers import RingBuffer, DROP_TAIL, DROP_HEAD, BLOCK, RED
+
+
+class DropPolicyTest(unittest.TestCase):
+    def test_drop_tail_keeps_the_oldest(self):
+        buf = RingBuffer(3, DROP_TAIL)
+        for i in range(5):
+            buf.put(i)
+        self.assertEqual(buf.put_many([5, 6]), 0)
+        self.assertEqual(buf.get_many(), [0, 1, 2])
+        self.assertEqual((buf.stats['enqueued'], buf.stats['dropped_tail'], buf.stats['high_water']), (3, 4, 3))
+
+    def test_drop_head_keeps_the_newest(self):
+        buf = RingBuffer(3, DROP_HEAD)
+        for i in range(5):
+            buf.put(i)
+        self.assertEqual(buf.put_many([5, 6]), 2)
+        self.assertEqual(buf.get_many(), [4, 5, 6])
+        self.assertEqual((buf.stats['enqueued'], buf.stats['dropped_head']), (7, 4))
+
+    def test_red_drops_more_as_it_fills(self):
+        random.seed(1)
+        buf = RingBuffer(100, RED, red_threshold=0.5)
+        self.assertEqual(buf.put_many(range(50)), 50)  # nothing is dropped below the threshold
+        added = buf.put_many(range(40))                 # past it, some are
+        self.assertGreater(added, 0)
+        self.assertLess(added, 40)
+        self.assertEqual(buf.stats['dropped_early'], 40 - added)
+        buf.put_many(range(1000))
+        self.assertEqual(len(buf), 100)                 # and once it's full, all of them are
+        self.assertEqual(buf.put_many(range(10)), 0)
+        self.assertEqual(buf.stats['enqueued'], 100)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            RingBuffer(10, 'drop-everything')
+
+
+class BlockPolicyTest(unittest.TestCase):
+    def test_put_waits_for_room(self):
+        buf = RingBuffer(1, BLOCK)
+        buf.put(0)
+        threading.Timer(0.1, buf.get).start()
+        start = time()
+        buf.put(1, timeout=5)
+        self.assertGreater(time() - start, 0.05)
+        self.assertEqual(buf.get_many(), [1])
+        self.assertEqual((buf.stats['blocked'], buf.stats['dropped_tail']), (1, 0))
+
+    def test_put_drops_after_timeout(self):
+        buf = RingBuffer(1, BLOCK)
+        buf.put(0)
+        buf.put(1, timeout=0.1)
+        buf.put(2, block=False)
+        self.assertEqual(buf.get_many(), [0])
+        self.assertEqual((buf.stats['blocked'], buf.stats['dropped_tail']), (1, 2))
+
+    def test_put_many_timeout_is_for_the_whole_batch(self):
+        buf = RingBuffer(2, BLOCK)
+        start = time()
+        self.assertEqual(buf.put_many(range(10), timeout=0.2), 2)
+        self.assertLess(time() - start, 0.5)
+        self.assertEqual(buf.stats['dropped_tail'], 8)
+
+    def test_put_many_waits_for_a_reader(self):
+        buf, got = RingBuffer(4, BLOCK), []
+
+        def reader():
+            while len(got) < 100:
+                got.extend(buf.get_many(timeout=1))
+        thread = threading.Thread(target=reader)
+        thread.start()
+        self.assertEqual(buf.put_many(range(100), timeout=5), 100)
+        thread.join()
+        self.assertEqual(got, list(range(100)))
+        self.assertEqual(buf.stats['dropped_tail'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
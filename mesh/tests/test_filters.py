@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# MIT License: Nick Sweeting
+
+#   python3 -m unittest mesh.tests.test_filters
+
+import unittest
+
+from mesh.filters import LoopbackFilter, UniqueFilter
+from mesh.simulation import Scheduler, SimLink, SimNode
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class LoopbackFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.filter = LoopbackFilter()
+        self.filter.clock = self.clock = FakeClock()
+
+    def test_drops_copies_of_sent_packets(self):
+        self.filter.tx(b'hello', None)
+        self.filter.tx(b'hello', None)
+        self.assertIsNone(self.filter.tr(b'hello', None))
+        self.assertIsNone(self.filter.tr(b'hello', None))
+        self.assertEqual(self.filter.tr(b'hello', None), b'hello')
+
+    def test_unanswered_sends_expire(self):
+        self.filter.tx(b'hello', None)
+        self.clock.now += self.filter.max_age - 1
+        self.filter.tx(b'later', None)
+        self.clock.now += 2
+        self.assertEqual(self.filter.tr(b'hello', None), b'hello')  # too old to still be waiting for
+        self.assertIsNone(self.filter.tr(b'later', None))
+
+    def test_max_count(self):
+        self.filter.max_count = 10
+        for i in range(11):
+            self.filter.tx(b'%d' % i, None)
+        self.assertEqual(self.filter.tr(b'0', None), b'0')
+        self.assertIsNone(self.filter.tr(b'10', None))
+
+
+class UniqueFilterTest(unittest.TestCase):
+    Filter = UniqueFilter.window(max_count=100, max_age=60.0)
+
+    def setUp(self):
+        self.filter = self.Filter()
+        self.filter.clock = self.clock = FakeClock()
+
+    def test_drops_packets_seen_before(self):
+        self.assertEqual(self.filter.tx(b'sent', None), b'sent')
+        self.assertEqual(self.filter.tr(b'new', None), b'new')
+        self.assertIsNone(self.filter.tr(b'new', None))
+        self.assertIsNone(self.filter.tr(b'sent', None))
+
+    def test_forgets_after_max_age(self):
+        self.filter.tr(b'old', None)
+        self.clock.now += 30
+        self.filter.tr(b'newer', None)
+        self.clock.now += 31
+        self.assertEqual(self.filter.tr(b'old', None), b'old')
+        self.assertIsNone(self.filter.tr(b'newer', None))
+
+    def test_forgets_after_max_count(self):
+        for i in range(101):
+            self.filter.tr(b'%d' % i, None)
+        self.assertEqual(self.filter.tr(b'0', None), b'0')
+        self.assertIsNone(self.filter.tr(b'100', None))
+
+
+class BloomUniqueFilterTest(UniqueFilterTest):
+    Filter = UniqueFilter.probabilistic(error_rate=0.0001, max_count=100, max_age=60.0)
+
+    # packets are remembered for one to two generations
+    def test_forgets_after_max_age(self):
+        self.filter.tr(b'old', None)
+        self.filter.tr(b'kept', None)
+        self.clock.now += 61
+        self.filter.tr(b'newer', None)  # starts the next generation
+        self.assertIsNone(self.filter.tr(b'kept', None))  # still in the previous one, and seeing it again adds it to this one
+        self.clock.now += 61
+        self.filter.tr(b'newest', None)
+        self.assertEqual(self.filter.tr(b'old', None), b'old')
+        self.assertIsNone(self.filter.tr(b'kept', None))
+        self.assertIsNone(self.filter.tr(b'newer', None))
+
+    def test_forgets_after_max_count(self):
+        for i in range(201):
+            self.filter.tr(b'%d' % i, None)
+        self.assertEqual(self.filter.tr(b'0', None), b'0')
+        self.assertIsNone(self.filter.tr(b'200', None))
+
+
+class SimNodeFilterClockTest(unittest.TestCase):
+    def test_filters_use_the_virtual_clock(self):
+        sim = Scheduler()
+        node = SimNode([SimLink('lan', sim)], 'n1', sim, Filters=[UniqueFilter, UniqueFilter.probabilistic()])
+        sim.call_at(60.0, lambda: None)
+        sim.run()
+        self.assertEqual([f.clock() for f in node.filters], [60.0, 60.0, 60.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# MIT License: Nick Sweeting
+
+# IRCLink against a stand-in IRC server on localhost, so the line parsing and flood control can be checked without the internet.
+#
+#   python3 -m unittest mesh.tests.test_irc
+#
+# Every IRCLink spends ~2 seconds connecting (it waits for the server to stop talking), so these take a little while.
+
+import threading
+import unittest
+from time import sleep, time
+from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+
+from mesh.links import IRCLink, FragmentingLink
+
+
+class FragmentingIRCLink(FragmentingLink, IRCLink):
+    pass
+
+
+class StandInIRCServer(threading.Thread):
+    """Just enough of an IRC server for IRCLink: it greets new clients, acknowledges their JOIN, and relays each
+    PRIVMSG to the other clients with the sender's prefix.  Every PRIVMSG/PONG it gets is recorded with when it arrived.
+    """
+    def __init__(self):
+        threading.Thread.__init__(self, name="irc-standin")
+        self.daemon = True
+        self.sock = socket(AF_INET, SOCK_STREAM)
+        self.sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(8)
+        self.port = self.sock.getsockname()[1]
+        self.clients = {}   # nick: socket
+        self.received = []  # (time, nick, line) of every PRIVMSG and PONG
+        self.lock = threading.Lock()
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            conn.sendall(b":standin NOTICE * :hello\r\n")
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def stop(self):
+        self.sock.close()
+        with self.lock:
+            for conn in self.clients.values():
+                conn.close()
+
+    def send_raw(self, nick, data):
+        """write bytes straight to a client, e.g. half a line"""
+        self.clients[nick].sendall(data)
+
+    def wait_for(self, count, timeout=10):
+        deadline = time() + timeout
+        while len(self.received) < count and time() < deadline:
+            sleep(0.01)
+        return list(self.received)
+
+    def handle(self, conn):
+        nick, buf = None, b""
+        while True:
+            try:
+                data = conn.recv(65536)
+            except OSError:
+                data = b""
+            if not data:
+                break
+            buf += data
+            *lines, buf = buf.split(b"\r\n")
+            for line in lines:
+                command, _, params = line.partition(b" ")
+                if command == b"NICK":
+                    nick = params.decode()
+                    with self.lock:
+                        self.clients[nick] = conn
+                elif command == b"JOIN":
+                    conn.sendall((":%s!user@localhost JOIN %s\r\n" % (nick, params.decode())).encode())
+                elif command in (b"PRIVMSG", b"PONG"):
+                    self.received.append((time(), nick, line))
+                    if command == b"PRIVMSG":
+                        self.relay(nick, b":%s!user@localhost %s\r\n" % (nick.encode(), line))
+                elif command == b"QUIT":
+                    break
+        with self.lock:
+            if self.clients.get(nick) is conn:
+                del self.clients[nick]
+        conn.close()
+
+    def relay(self, sender, line):
+        with self.lock:
+            others = [conn for nick, conn in self.clients.items() if nick != sender]
+        for conn in others:
+            try:
+                conn.sendall(line)
+            except OSError:
+                pass
+
+
+class IRCLinkTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInIRCServer()
+        self.server.start()
+        self.links = []
+
+    def tearDown(self):
+        for link in self.links:
+            link.stop()
+            link.net_socket.close()
+        self.server.stop()
+
+    def connect(self, nick, LinkClass=IRCLink, start=True, **kwargs):
+        link = LinkClass(name=nick, server='127.0.0.1', port=self.server.port, channel='#test', nick=nick, **kwargs)
+        link.log = lambda *args: None
+        link.attach('n1')
+        if start:
+            link.start()
+            self.links.append(link)
+        return link
+
+    def recv(self, link, count, timeout=5):
+        packets, deadline = [], time() + timeout
+        while len(packets) < count and time() < deadline:
+            packets += link.recv_many('n1')
+            sleep(0.01)
+        return packets
+
+    def test_multiple_and_split_lines(self):
+        link = self.connect('alice')
+        # three lines in one read, then a line cut in half across two reads
+        self.server.send_raw('alice', b":bob!u@h PRIVMSG #test :one\r\n:bob!u@h PRIVMSG #test :two\r\n:bob!u@h PRIVMSG #test :thr")
+        sleep(0.2)
+        self.server.send_raw('alice', b"ee\r\nPING :standin\r\n")
+        self.assertEqual(self.recv(link, 3), [b"one", b"two", b"three"])
+        self.assertEqual(self.server.wait_for(1)[0][2], b"PONG :standin")
+
+    def test_flood_rate(self):
+        link = self.connect('alice', flood_burst=3, flood_rate=10)
+        link.send_many([b"msg%d" % i for i in range(13)])
+        received = self.server.wait_for(13)
+        self.assertEqual([line.rsplit(b":", 1)[1] for _, _, line in received], [b"msg%d" % i for i in range(13)])
+        times = [when for when, _, _ in received]
+        self.assertLess(times[2] - times[0], 0.1)           # the burst goes out right away
+        self.assertGreater(times[-1] - times[0], 0.9)       # then 10 more at 10 lines per second
+        self.assertLess(times[-1] - times[0], 1.5)
+
+    def test_frame_roundtrip(self):
+        link = self.connect('alice', framing='base85', start=False)
+        packets = [b"", b"\x00\xff" * 10, bytes(range(256)) * 20, b"x" * 50] + [b"%d" % i for i in range(50)]
+        link.sendq.extend(packets)
+        lines = []
+        while link.sendq or link.sending:
+            lines.append(link._next_line())
+        for line in lines:
+            self.assertLessEqual(len(line) + link.prefix_room, link.max_line)
+        unframed = []
+        for line in lines:
+            text, _ = link._parse_msg(b":bob!u@h " + line.rstrip(b"\r\n"))
+            unframed += link._unframe(text[1:], b"bob")
+        self.assertEqual(unframed, packets)
+        self.assertLess(len(lines), len(packets))  # small packets share lines
+        link.net_socket.close()
+
+    def test_binary_packets_between_links(self):
+        alice = self.connect('alice', framing='base85', flood_burst=100)
+        bob = self.connect('bob', framing='base85', flood_burst=100)
+        packets = [bytes(range(256)) * 8, b"\r\n\x00 binary", b"hi"]
+        alice.send_many(packets)
+        self.assertEqual(self.recv(bob, 3), packets)
+
+    def test_fragmenting_link(self):
+        alice = self.connect('alice', FragmentingIRCLink, framing='base85', fragment_mtu=300, flood_burst=100)
+        bob = self.connect('bob', FragmentingIRCLink, framing='base85', fragment_mtu=300, flood_burst=100)
+        self.server.send_raw('bob', b":carol!u@h PRIVMSG #test :plain line\r\n")
+        self.assertEqual(self.recv(bob, 1), [b"plain line"])
+        packet = b"0123456789" * 100
+        alice.send(packet)
+        self.assertEqual(self.recv(bob, 1), [packet])
+        self.assertEqual(bob.stats['reassembled'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
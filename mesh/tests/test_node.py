@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# MIT License: Nick Sweeting
+
+#   python3 -m unittest mesh.tests.test_node
+
+import asyncio
+import unittest
+from time import sleep
+
+from mesh.links import VirtualLink
+from mesh.node import Node
+from mesh.aio import AsyncNode
+
+
+class SlowStartingNode(Node):
+    def run(self):
+        sleep(0.2)  # a busy machine can take this long to schedule a new thread
+        Node.run(self)
+
+
+class NodeStartTest(unittest.TestCase):
+    def test_packets_sent_right_after_start_arrive(self):
+        link = VirtualLink('vl1')
+        link.log = lambda *args: None
+        a, b = SlowStartingNode([link], 'a'), SlowStartingNode([link], 'b')
+        a.log = b.log = lambda *args: None
+        a.start()
+        b.start()
+        a.send(b'hello')  # before b's thread has had a chance to run
+        try:
+            self.assertEqual(b.inq[link].get(timeout=2), b'hello')
+        finally:
+            a.stop()
+            b.stop()
+
+    def test_async_packets_sent_right_after_start_arrive(self):
+        link = VirtualLink('vl1')
+        link.log = lambda *args: None
+        loop = asyncio.new_event_loop()
+        a, b = AsyncNode([link], 'a'), AsyncNode([link], 'b')
+        a.log = b.log = lambda *args: None
+        a.start(loop)
+        b.start(loop)
+        a.send(b'hello')  # before either task has run
+
+        async def recv():
+            for _ in range(100):
+                if len(b.inq[link]):
+                    return b.inq[link].get_nowait()
+                await asyncio.sleep(0.01)
+        try:
+            self.assertEqual(loop.run_until_complete(recv()), b'hello')
+        finally:
+            a.stop()
+            b.stop()
+            loop.run_until_complete(asyncio.gather(a.task, b.task))
+            loop.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
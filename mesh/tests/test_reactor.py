@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# MIT License: Nick Sweeting
+
+#   python3 -m unittest mesh.tests.test_reactor
+
+import unittest
+from time import sleep
+
+from mesh.reactor import Reactor
+
+
+class ReactorTest(unittest.TestCase):
+    def test_failing_callback_doesnt_stop_the_reactor(self):
+        reactor = Reactor()
+        reactor.start()
+        ran = []
+        reactor.call_soon(lambda: 1 / 0)
+        reactor.call_soon(ran.append, 'soon')
+        reactor.call_later(0, lambda: 1 / 0)
+        reactor.call_later(0.01, ran.append, 'later')
+        sleep(0.2)
+        self.assertTrue(reactor.is_alive())
+        self.assertEqual(ran, ['soon', 'later'])
+        reactor.stop()
+
+    def test_callbacks_from_before_start_run_first(self):
+        reactor = Reactor()
+        ran = []
+        reactor.call_soon(ran.append, 'before')
+        reactor.start()
+        reactor.call_soon(ran.append, 'after')
+        sleep(0.1)
+        reactor.stop()
+        self.assertEqual(ran, ['before', 'after'])
+        self.assertFalse(reactor.call_soon(ran.append, 'too late'))
+
+
+if __name__ == '__main__':
+    unittest.main()
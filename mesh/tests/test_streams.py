@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# MIT License: Nick Sweeting
+
+#   python3 -m unittest mesh.tests.test_streams
+
+import unittest
+from time import sleep, time
+from socket import socket, AF_INET, SOCK_STREAM
+
+from mesh.links import TCPLink, UnixSocketLink
+from mesh.reactor import Reactor
+
+
+def free_port():
+    sock = socket(AF_INET, SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class StreamLinkTest(unittest.TestCase):
+    def setUp(self):
+        self.links = []
+
+    def tearDown(self):
+        for link in self.links:
+            link.stop()
+
+    def quiet(self, *links):
+        for link in links:
+            link.log = lambda *args: None
+            self.links.append(link)
+        return links
+
+    def recv(self, link, mac_addr, count, timeout=5):
+        packets, deadline = [], time() + timeout
+        while len(packets) < count and time() < deadline:
+            packets += link.recv_many(mac_addr, timeout=0.05)
+        return packets
+
+    def test_pair_frames_any_bytes(self):
+        a, b = self.quiet(*UnixSocketLink.pair())
+        b.attach('x')
+        a.start()
+        b.start()
+        packets = [b'', b'\x00binary\xff\r\n', bytes(range(256)) * 4096, b'hi']
+        a.send_many(packets)
+        a.send(b'for someone else', 'y')
+        a.send(b'just for x', 'x')
+        self.assertEqual(self.recv(b, 'x', 5), packets + [b'just for x'])
+        self.assertEqual(b.stats['undeliverable'], 1)
+
+    def test_pair_many_packets_in_order(self):
+        a, b = self.quiet(*UnixSocketLink.pair())
+        b.attach('x')
+        a.start()
+        b.start()
+        for i in range(100):
+            a.send_many([b'%d-%d' % (i, j) for j in range(100)])
+        self.assertEqual(self.recv(b, 'x', 10000), [b'%d-%d' % (i, j) for i in range(100) for j in range(100)])
+
+    def test_reconnect_sends_the_backlog(self):
+        port = free_port()
+        server, client = self.quiet(TCPLink('t1', port=port, host='127.0.0.1'),
+                                    TCPLink('t1', peers=[('127.0.0.1', port)], reconnect_delay=0.05, max_reconnect_delay=0.2))
+        server.attach('s')
+        client.attach('c')
+        server.start()
+        client.start()
+        client.send(b'hello server', 's')
+        self.assertEqual(self.recv(server, 's', 1), [b'hello server'])
+        server.send(b'hello client', 'c')
+        self.assertEqual(self.recv(client, 'c', 1), [b'hello client'])
+
+        server.stop()
+        sleep(0.2)
+        client.send(b'sent while it was down', 's')
+        restarted, = self.quiet(TCPLink('t1', port=port, host='127.0.0.1'))
+        restarted.attach('s')
+        restarted.start()
+        self.assertEqual(self.recv(restarted, 's', 1), [b'sent while it was down'])
+        self.assertEqual(client.stats['connects'], 2)
+        self.assertEqual(client.stats['disconnects'], 1)
+
+    def test_unresolvable_peer_keeps_retrying(self):
+        reactor = Reactor('shared')
+        reactor.start()
+        try:
+            link, a, b = self.quiet(TCPLink('t1', peers=[('no-such-host.invalid', 2016)], reactor=reactor, reconnect_delay=0.05),
+                                    *UnixSocketLink.pair(reactor=reactor))
+            b.attach('x')
+            for started in (link, a, b):
+                started.start()
+            sleep(0.3)
+            # the failed lookups don't take down the reactor, so the other links on it keep working
+            self.assertTrue(reactor.is_alive())
+            a.send(b'still here')
+            self.assertEqual(self.recv(b, 'x', 1), [b'still here'])
+            self.assertGreater(link.connections[0].delay, 0)
+            self.assertEqual(link.stats['connects'], 0)
+        finally:
+            for link in self.links:
+                link.stop()
+            self.links = []
+            reactor.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()